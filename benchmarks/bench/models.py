@@ -0,0 +1,30 @@
+from django.db import models
+
+from django_votes.models import VotesField, RatingsField
+
+
+class Entry(models.Model):
+    """
+    The object voted on by the benchmarks.
+    """
+    title = models.CharField(max_length=100)
+
+    votes = VotesField()
+    ratings = RatingsField()
+
+    def __unicode__(self):
+        return self.title
+
+
+class CompactEntry(models.Model):
+    """
+    The object voted on by the compact scenario, with the compact vote and
+    rating tables.
+    """
+    title = models.CharField(max_length=100)
+
+    votes = VotesField(compact=True)
+    ratings = RatingsField(compact=True)
+
+    def __unicode__(self):
+        return self.title
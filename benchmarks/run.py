@@ -0,0 +1,375 @@
+"""
+Benchmarks of the vote, rating and summary hot paths.
+
+    python benchmarks/run.py [--scenario vote] [--rows 10000,100000] [--output results.json]
+
+Every scenario reports the number of operations, the throughput, the p50
+and p99 latency and the average number of queries per operation. The
+results are written as JSON, so that runs can be compared.
+"""
+import json
+import os
+import platform
+import random
+import sys
+import threading
+from datetime import datetime
+from optparse import OptionParser
+from timeit import default_timer as timer
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'benchmarks.settings')
+
+import django
+from django.db import connection, connections, reset_queries
+from django.template import Template, Context
+from django.contrib.auth.models import User
+
+from django_votes import settings as votes_settings
+from django_votes.utils import bulk_insert
+from benchmarks.bench.models import Entry, CompactEntry
+
+
+def _percentile(timings, percent):
+    """
+    Nearest-rank percentile of a sorted list of timings.
+    """
+    if not timings:
+        return None
+    return timings[min(len(timings) - 1, int(len(timings) * percent / 100.0))]
+
+def _result(name, timings, queries, seconds=None, **params):
+    """
+    Summarize the timings (in seconds) and query counts of the operations of
+    a benchmark.
+    """
+    timings = sorted(timings)
+    seconds = sum(timings) if seconds is None else seconds
+    return {
+        'name': name,
+        'params': params,
+        'ops': len(timings),
+        'seconds': round(seconds, 6),
+        'throughput': round(len(timings) / seconds, 2) if seconds else None,
+        'p50_ms': round(_percentile(timings, 50) * 1000, 3) if timings else None,
+        'p99_ms': round(_percentile(timings, 99) * 1000, 3) if timings else None,
+        'queries_per_op': round(float(sum(queries)) / len(queries), 2) if queries else None,
+    }
+
+def _measure(func, *args, **kwargs):
+    """
+    Run func, returns (seconds, queries, result).
+    """
+    reset_queries()
+    start = timer()
+    result = func(*args, **kwargs)
+    seconds = timer() - start
+    return seconds, len(connection.queries), result
+
+def _users(count, prefix):
+    bulk_insert(User, [User(username='%s%d' % (prefix, i)) for i in range(count)])
+    return list(User.objects.filter(username__startswith=prefix))
+
+def _entries(count, prefix, model=Entry):
+    bulk_insert(model, [model(title='%s%d' % (prefix, i)) for i in range(count)])
+    return list(model.objects.filter(title__startswith=prefix).values_list('pk', flat=True))
+
+def _insert_votes(vote_model, entries, users, start, stop):
+    """
+    Insert the votes start to stop of a table where every object gets the
+    votes of all users.
+    """
+    batch = []
+    for i in range(start, stop):
+        batch.append(vote_model(object_id=entries[i // len(users)], voter_id=users[i % len(users)].pk,
+                                value=random.choice((1, -1)), date=datetime.now()))
+        if len(batch) >= 10000:
+            bulk_insert(vote_model, batch)
+            batch = []
+    bulk_insert(vote_model, batch)
+
+def _table_size(model):
+    """
+    The size in bytes of the table of a model, with its indexes, or None
+    when the database can't tell.
+    """
+    cursor = connection.cursor()
+    if connection.vendor == 'postgresql':
+        cursor.execute('SELECT pg_total_relation_size(%s)', [model._meta.db_table])
+    elif connection.vendor == 'mysql':
+        cursor.execute('SELECT data_length + index_length FROM information_schema.tables '
+                       'WHERE table_schema = DATABASE() AND table_name = %s', [model._meta.db_table])
+    else:
+        return None
+    return int(cursor.fetchone()[0])
+
+
+def bench_vote(options):
+    """
+    Single votes: new votes on objects without a summary, new votes on
+    objects with a summary, and changed votes.
+    """
+    count = options.ops
+    users = _users(count, 'vote-user-')
+    entries = _entries(count, 'vote-entry-')
+    results = []
+
+    for name, pairs, value in (('vote_first', zip(users, entries), 1),
+                               ('vote_new', zip(users, entries[1:] + entries[:1]), 1),
+                               ('vote_change', zip(users, entries), -1)):
+        timings, queries = [], []
+        for user, entry_id in pairs:
+            seconds, query_count, _ = _measure(Entry.votes.cast, user, entry_id, value)
+            timings.append(seconds)
+            queries.append(query_count)
+        results.append(_result(name, timings, queries))
+    return results
+
+def bench_rate(options):
+    """
+    Single ratings, new and changed.
+    """
+    count = options.ops
+    users = _users(count, 'rate-user-')
+    entries = _entries(10, 'rate-entry-')
+    results = []
+
+    for name, value in (('rate_new', 4), ('rate_change', 2)):
+        timings, queries = [], []
+        for i, user in enumerate(users):
+            seconds, query_count, _ = _measure(Entry.ratings.cast, user, entries[i % len(entries)], value)
+            timings.append(seconds)
+            queries.append(query_count)
+        results.append(_result(name, timings, queries))
+    return results
+
+def bench_concurrent_votes(options):
+    """
+    Votes of many users on one object, cast from several threads at once.
+    """
+    threads = options.threads
+    users = _users(options.ops, 'concurrent-user-')
+    entry_id = _entries(1, 'concurrent-entry-')[0]
+    # Create the summary up front, like for an object that is already popular.
+    Entry.vote_summary_model.objects.get_many([entry_id])
+
+    timings, queries, errors = [], [], []
+    lock = threading.Lock()
+
+    def worker(voters):
+        connection = connections['default']
+        connection.use_debug_cursor = True
+        try:
+            for voter in voters:
+                del connection.queries[:]
+                start = timer()
+                try:
+                    Entry.votes.cast(voter, entry_id, random.choice((1, -1)))
+                except Exception as e:
+                    with lock:
+                        errors.append(unicode(e))
+                    continue
+                seconds = timer() - start
+                with lock:
+                    timings.append(seconds)
+                    queries.append(len(connection.queries))
+        finally:
+            connection.close()
+
+    workers = [threading.Thread(target=worker, args=(users[i::threads],)) for i in range(threads)]
+    start = timer()
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+    seconds = timer() - start
+
+    result = _result('concurrent_votes', timings, queries, seconds=seconds, threads=threads)
+    result['errors'] = len(errors)
+    summary = Entry.vote_summary_model.objects.get(object=entry_id)
+    result['lost_votes'] = len(timings) - summary.up_votes - summary.down_votes
+    return [result]
+
+_LIST_TEMPLATE = Template("""{% for entry in entries %}
+{{ entry.title }}: {{ entry.vote_summary.up_votes }} up, {{ entry.vote_summary.down_votes }} down,
+rated {{ entry.rating_summary.rating }}
+{% endfor %}""")
+
+def bench_list(options):
+    """
+    Rendering a list of N objects with their summaries, with the summaries
+    read one by one, prefetched, and prefetched from the cache. Also reads
+    cached summaries without rendering, which takes no query at all.
+    """
+    users = _users(20, 'list-user-')
+    results = []
+    for size in options.list_sizes:
+        entries = _entries(size, 'list-%d-entry-' % size)
+        Entry.votes.bulk_cast([(random.choice(users).pk, entry_id, 1) for entry_id in entries])
+        Entry.ratings.bulk_cast([(random.choice(users).pk, entry_id, 3) for entry_id in entries])
+
+        def plain():
+            objects = Entry.objects.filter(pk__in=entries)
+            return _LIST_TEMPLATE.render(Context({'entries': objects}))
+
+        def prefetched():
+            objects = Entry.objects.filter(pk__in=entries)
+            return _LIST_TEMPLATE.render(Context({
+                'entries': Entry.with_rating_summaries(Entry.with_vote_summaries(objects))}))
+
+        def cached_read():
+            return Entry.vote_summary_model.objects.get_many(entries)
+
+        for name, func, cache in (('list_render', plain, None),
+                                  ('list_render_prefetched', prefetched, None),
+                                  ('list_render_cached', prefetched, 'default'),
+                                  ('summaries_cached_read', cached_read, 'default')):
+            votes_settings.SUMMARY_CACHE = cache
+            try:
+                func()  # Warm up, fills the cache.
+                timings, queries = [], []
+                for i in range(options.repeat):
+                    seconds, query_count, _ = _measure(func)
+                    timings.append(seconds)
+                    queries.append(query_count)
+            finally:
+                votes_settings.SUMMARY_CACHE = None
+            results.append(_result(name, timings, queries, size=size))
+    return results
+
+def bench_rebuild(options):
+    """
+    Rebuilding all vote summaries from a votes table of N rows.
+    """
+    voters = 1000
+    users = _users(voters, 'rebuild-user-')
+    entries = []
+    inserted = 0
+    results = []
+    # The votes table grows from one size to the next, every object gets
+    # the votes of all voters.
+    for rows in sorted(options.rows):
+        needed = (rows + voters - 1) // voters - len(entries)
+        if needed > 0:
+            entries.extend(_entries(needed, 'rebuild-%d-entry-' % rows))
+
+        _insert_votes(Entry.vote_model, entries, users, inserted, rows)
+        inserted = max(rows, inserted)
+
+        seconds, query_count, computed = _measure(Entry.vote_summary_model.rebuild)
+        result = _result('rebuild', [seconds], [query_count], rows=rows,
+                         table_rows=Entry.vote_model.objects.count(), summaries=computed)
+        result['rows_per_second'] = round(result['params']['table_rows'] / seconds, 2)
+        results.append(result)
+    return results
+
+def bench_compact(options):
+    """
+    The default and the compact vote tables (VotesField(compact=True)) side
+    by side, at every table size: bulk insert, summary rebuild, reading
+    votes without an explicit order, the votes of one object, the votes of
+    a user on a page of objects, and the size of the table.
+    """
+    voters = 1000
+    users = _users(voters, 'compact-user-')
+    results = []
+    for schema, model in (('default', Entry), ('compact', CompactEntry)):
+        vote_model = model.vote_model
+        entries = []
+        inserted = 0
+        for rows in sorted(options.rows):
+            params = {'schema': schema, 'rows': rows}
+            needed = (rows + voters - 1) // voters - len(entries)
+            if needed > 0:
+                entries.extend(_entries(needed, 'compact-%d-entry-' % rows, model))
+
+            seconds, query_count, _ = _measure(_insert_votes, vote_model, entries, users, inserted, rows)
+            result = _result('compact_insert', [seconds], [query_count], **params)
+            result['rows_per_second'] = round((rows - inserted) / seconds, 2) if seconds else None
+            results.append(result)
+            inserted = max(rows, inserted)
+
+            seconds, query_count, _ = _measure(model.vote_summary_model.rebuild)
+            results.append(_result('compact_rebuild', [seconds], [query_count], **params))
+
+            page = entries[:100]
+            for name, func in (
+                    ('compact_fetch', lambda: list(vote_model.objects.values_list('value', flat=True)[:1000])),
+                    ('compact_object_votes', lambda: list(vote_model.objects.filter(object=random.choice(entries))
+                                                                          .values_list('voter', 'value'))),
+                    ('compact_user_votes', lambda: model.votes.user_votes(random.choice(users), page))):
+                timings, queries = [], []
+                for i in range(options.repeat):
+                    seconds, query_count, _ = _measure(func)
+                    timings.append(seconds)
+                    queries.append(query_count)
+                results.append(_result(name, timings, queries, **params))
+
+            results.append({'name': 'compact_table_size', 'params': params,
+                            'bytes': _table_size(vote_model)})
+    return results
+
+SCENARIOS = (
+    ('vote', bench_vote),
+    ('rate', bench_rate),
+    ('concurrent', bench_concurrent_votes),
+    ('list', bench_list),
+    ('rebuild', bench_rebuild),
+    ('compact', bench_compact),
+)
+
+def _int_list(value):
+    return [int(item) for item in value.split(',') if item]
+
+def main(argv=None):
+    parser = OptionParser(usage='%prog [options]')
+    parser.add_option('--scenario', action='append', dest='scenarios', default=[],
+                      help='Only run this scenario (%s). Can be given more than once.'
+                           % ', '.join(name for name, func in SCENARIOS))
+    parser.add_option('--ops', type='int', default=500,
+                      help='Number of votes of the vote, rate and concurrent scenarios.')
+    parser.add_option('--threads', type='int', default=8,
+                      help='Number of threads of the concurrent scenario.')
+    parser.add_option('--list-sizes', default='10,100,1000',
+                      help='Comma separated list sizes of the list scenario.')
+    parser.add_option('--repeat', type='int', default=20,
+                      help='Number of renderings per list size, and of reads per table size '
+                           'of the compact scenario.')
+    parser.add_option('--rows', default='10000,100000,1000000',
+                      help='Comma separated votes table sizes of the rebuild and compact scenarios.')
+    parser.add_option('--seed', type='int', default=0)
+    parser.add_option('--output', help='Write the results to this file instead of stdout.')
+    options, args = parser.parse_args(argv)
+    options.list_sizes = _int_list(options.list_sizes)
+    options.rows = _int_list(options.rows)
+
+    scenarios = dict(SCENARIOS)
+    for name in options.scenarios:
+        if name not in scenarios:
+            parser.error('No such scenario "%s"' % name)
+
+    random.seed(options.seed)
+    old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True)
+    connection.use_debug_cursor = True
+    try:
+        results = []
+        for name, func in SCENARIOS:
+            if not options.scenarios or name in options.scenarios:
+                sys.stderr.write('Running %s\n' % name)
+                results.extend(func(options))
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+    report = {
+        'date': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'django': django.get_version(),
+        'database': connection.vendor,
+        'results': results,
+    }
+    output = open(options.output, 'w') if options.output else sys.stdout
+    json.dump(report, output, indent=2)
+    output.write('\n')
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,51 @@
+"""
+Settings for running the benchmarks, see benchmarks/run.py.
+
+SQLite is used by default. Set BENCH_DATABASE=postgresql to run against a
+local Postgres instead, configured through the usual PGDATABASE, PGUSER,
+PGPASSWORD, PGHOST and PGPORT environment variables. The benchmarks create
+and drop their own test database.
+"""
+import os
+import tempfile
+
+if os.environ.get('BENCH_DATABASE') == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql_psycopg2',
+            'NAME': os.environ.get('PGDATABASE', 'django_votes'),
+            'USER': os.environ.get('PGUSER', ''),
+            'PASSWORD': os.environ.get('PGPASSWORD', ''),
+            'HOST': os.environ.get('PGHOST', ''),
+            'PORT': os.environ.get('PGPORT', ''),
+        }
+    }
+else:
+    # A database file rather than :memory:, the concurrent benchmark votes
+    # from several threads, each with their own connection.
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.path.join(tempfile.gettempdir(), 'django_votes_bench.sqlite3'),
+            'TEST_NAME': os.path.join(tempfile.gettempdir(), 'django_votes_bench.sqlite3'),
+            'OPTIONS': {'timeout': 30},
+        }
+    }
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }
+}
+
+INSTALLED_APPS = (
+    'django.contrib.auth',
+    'django.contrib.contenttypes',
+    'django.contrib.sessions',
+    'django_votes',
+    'benchmarks.bench',
+)
+
+DEBUG = False
+SECRET_KEY = 'django-votes-benchmarks'
+USE_TZ = False
@@ -0,0 +1,252 @@
+"""
+Backends keeping the counters of the vote and rating summaries, chosen with
+the VOTES_SUMMARY_BACKEND setting or per field with
+VotesField(summary_backend=...).
+
+DatabaseBackend, the default, keeps them in the summary tables.
+
+CacheCounterBackend keeps them in one of the caches of settings.CACHES
+(VOTES_SUMMARY_COUNTER_CACHE) and changes them with the atomic increments
+of the cache, incr() and decr(). Reading a summary doesn't touch the
+database once its counters are in the cache. The counters of an object are
+loaded from its summary row the first time they are needed; every change is
+logged in the cache, and the flush_vote_counters command writes the
+counters of the objects in the log back to the summary tables in bulk. The
+cache must keep the counters until they are flushed: counters which are
+evicted before lose their unflushed changes, until the next
+reconcile_vote_summaries.
+"""
+from collections import defaultdict
+
+from django.core.cache import get_cache
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.importlib import import_module
+
+from django_votes import leaderboard as leaderboards
+from django_votes import settings as votes_settings
+from django_votes.instrumentation import count
+
+_backends = {}
+
+def get_backend(path=None):
+    """
+    The backend with the given dotted path, VOTES_SUMMARY_BACKEND by
+    default. The models using the same backend share one instance.
+    """
+    path = path or votes_settings.SUMMARY_BACKEND
+    if path not in _backends:
+        module_name, class_name = path.rsplit('.', 1)
+        try:
+            backend_class = getattr(import_module(module_name), class_name)
+        except (ImportError, AttributeError) as e:
+            raise ImproperlyConfigured('Could not load the summary backend "%s": %s' % (path, e))
+        _backends[path] = backend_class()
+    return _backends[path]
+
+
+class SummaryBackend(object):
+    """
+    Interface of the summary backends.
+    """
+    def add(self, summary_model, object_id, deltas, create=True, deferred=None, shard_key=None):
+        """
+        Add the deltas (field name -> increment) to the counters of an
+        object. The vote behind them is already in the votes table. When the
+        object has no summary yet, one is only created when create is True.
+        Returns True when the counters were changed.
+        """
+        raise NotImplementedError
+
+    def get_many(self, summary_model, object_ids, create=True):
+        """
+        Return a dict object_id -> summary. Missing summaries are computed
+        from the votes table when create is True, and left out otherwise.
+        """
+        raise NotImplementedError
+
+    def discard(self, summary_model, object_ids=None):
+        """
+        Forget the counters of the given objects, or of all objects, whose
+        summaries are about to be computed from the votes table.
+        """
+
+    def flush(self, summary_model, batch_size=1000):
+        """
+        Write the counters kept outside of the summary tables back to them.
+        Returns the number of summaries written.
+        """
+        return 0
+
+
+class DatabaseBackend(SummaryBackend):
+    """
+    Keeps the counters in the summary tables, see VoteSummary.
+    """
+    def add(self, summary_model, object_id, deltas, create=True, deferred=None, shard_key=None):
+        from django_votes.models import _update_summary
+        return _update_summary(summary_model, object_id, deltas, create, deferred, shard_key)
+
+    def get_many(self, summary_model, object_ids, create=True):
+        return summary_model.objects.get_from_database(object_ids, create)
+
+
+class CacheCounterBackend(SummaryBackend):
+    """
+    Keeps the counters in a cache, changed with incr() and decr(). Deferred
+    mode and shards don't apply, the increments don't lock anything.
+    """
+    def _cache(self):
+        return get_cache(votes_settings.SUMMARY_COUNTER_CACHE)
+
+    def _key(self, summary_model, object_id, field):
+        return 'django_votes:counter:%s:%s:%s' % (summary_model.get_model_name(), object_id, field)
+
+    def _log_key(self, summary_model, position=None):
+        """
+        Key of the position of the last change in the log, or of the object
+        changed at the given position.
+        """
+        key = 'django_votes:counter_log:%s' % summary_model.get_model_name()
+        return key if position is None else '%s:%d' % (key, position)
+
+    def _flushed_key(self, summary_model):
+        return 'django_votes:counter_flushed:%s' % summary_model.get_model_name()
+
+    def _incr(self, cache, key, delta):
+        # Memcached only increments by positive amounts.
+        if delta > 0:
+            return cache.incr(key, delta)
+        return cache.decr(key, -delta)
+
+    def _summary(self, summary_model, object_id, counters):
+        summary = summary_model(object_id=object_id, **counters)
+        summary.update_derived()
+        return summary
+
+    def _read(self, cache, summary_model, object_ids):
+        """
+        The summaries of the objects among object_ids which have all their
+        counters in the cache, read with one get_many.
+        """
+        fields = summary_model.counter_fields
+        keys = dict((self._key(summary_model, object_id, field), (object_id, field))
+                    for object_id in object_ids for field in fields)
+        counters = defaultdict(dict)
+        for key, value in cache.get_many(keys.keys()).items():
+            object_id, field = keys[key]
+            counters[object_id][field] = value
+        return dict((object_id, self._summary(summary_model, object_id, values))
+                    for object_id, values in counters.items() if len(values) == len(fields))
+
+    def _log(self, cache, summary_model, object_id):
+        """
+        Log the change of the counters of an object, for flush().
+        """
+        timeout = votes_settings.SUMMARY_COUNTER_TIMEOUT
+        log_key = self._log_key(summary_model)
+        # A log which was evicted, or expired (incr() doesn't extend the
+        # timeout of memcached), restarts after the last flushed position.
+        cache.add(log_key, cache.get(self._flushed_key(summary_model)) or 0, timeout)
+        cache.set(self._log_key(summary_model, cache.incr(log_key)), object_id, timeout)
+
+    def add(self, summary_model, object_id, deltas, create=True, deferred=None, shard_key=None):
+        deltas = dict((field, delta) for field, delta in deltas.items() if delta)
+        if not deltas:
+            return False
+
+        cache = self._cache()
+        missing = {}
+        for field, delta in deltas.items():
+            try:
+                self._incr(cache, self._key(summary_model, object_id, field), delta)
+            except ValueError:
+                missing[field] = delta
+
+        if missing:
+            summary = summary_model.objects.get_from_database([object_id], create=False).get(object_id)
+            if summary is None:
+                if not create:
+                    return False
+                # Computed from the votes table, which already has the vote.
+                counters, counted = summary_model.compute(object_id), True
+            else:
+                counters, counted = dict((field, getattr(summary, field))
+                                         for field in summary_model.counter_fields), False
+            for field in summary_model.counter_fields:
+                key = self._key(summary_model, object_id, field)
+                loaded = cache.add(key, counters[field], votes_settings.SUMMARY_COUNTER_TIMEOUT)
+                if field in missing and not (loaded and counted):
+                    self._incr(cache, key, missing[field])
+            count('summary_counters_loaded', len(missing))
+
+        count('summary_counters_updated')
+        self._log(cache, summary_model, object_id)
+        if leaderboards.loaded(summary_model):
+            summary = self._read(cache, summary_model, [object_id]).get(object_id)
+            if summary is not None:
+                leaderboards.update(summary_model, object_id, getattr(summary, summary_model.ranking_field))
+        return True
+
+    def get_many(self, summary_model, object_ids, create=True):
+        object_ids = set(object_ids)
+        cache = self._cache()
+        summaries = self._read(cache, summary_model, object_ids)
+        count('summary_counter_hits', len(summaries))
+
+        missing = object_ids.difference(summaries)
+        if missing:
+            count('summary_counter_misses', len(missing))
+            stored = summary_model.objects.get_from_database(missing, create)
+            timeout = votes_settings.SUMMARY_COUNTER_TIMEOUT
+            for object_id, summary in stored.items():
+                for field in summary_model.counter_fields:
+                    cache.add(self._key(summary_model, object_id, field), getattr(summary, field), timeout)
+            # Read them back, votes may have changed them in the meantime.
+            loaded = self._read(cache, summary_model, stored.keys())
+            summaries.update((object_id, loaded.get(object_id, summary))
+                             for object_id, summary in stored.items())
+        return summaries
+
+    def discard(self, summary_model, object_ids=None):
+        cache = self._cache()
+        if object_ids is None:
+            object_ids = set(summary_model.objects.values_list('object', flat=True).order_by())
+            object_ids.update(self._logged(cache, summary_model)[2])
+        object_ids = list(object_ids)
+        for i in range(0, len(object_ids), 1000):
+            cache.delete_many([self._key(summary_model, object_id, field)
+                               for object_id in object_ids[i:i + 1000]
+                               for field in summary_model.counter_fields])
+
+    def _logged(self, cache, summary_model, batch_size=None):
+        """
+        The positions of the log after the last flush, up to batch_size of
+        them, as (start, end, object_ids changed at start + 1 to end).
+        """
+        start = cache.get(self._flushed_key(summary_model)) or 0
+        end = cache.get(self._log_key(summary_model)) or 0
+        if end < start:
+            # The log restarted behind the last flush, read it from the start.
+            start = 0
+            cache.set(self._flushed_key(summary_model), 0, votes_settings.SUMMARY_COUNTER_TIMEOUT)
+        if batch_size is not None:
+            end = min(end, start + batch_size)
+        keys = [self._log_key(summary_model, position) for position in range(start + 1, end + 1)]
+        found = cache.get_many(keys)
+        if len(found) < len(keys):
+            # A change was counted, but its object not written yet.
+            found.update(cache.get_many([key for key in keys if key not in found]))
+        return start, end, set(found.values())
+
+    def flush(self, summary_model, batch_size=1000):
+        cache = self._cache()
+        written = 0
+        while True:
+            start, end, object_ids = self._logged(cache, summary_model, batch_size)
+            if end <= start:
+                return written
+
+            written += summary_model.objects.store_many(self._read(cache, summary_model, object_ids))
+            cache.set(self._flushed_key(summary_model), end, votes_settings.SUMMARY_COUNTER_TIMEOUT)
+            cache.delete_many([self._log_key(summary_model, position)
+                               for position in range(start + 1, end + 1)])
@@ -0,0 +1,96 @@
+"""
+Optional cache for vote and rating summaries, enabled with the
+VOTES_SUMMARY_CACHE setting.
+
+Summaries are invalidated whenever a vote or rating changes them. A full
+rebuild of all summaries doesn't invalidate them, it becomes visible once
+VOTES_SUMMARY_CACHE_TIMEOUT has passed.
+
+The votes of a user on an object (see VoteManager.user_votes) can be
+cached as well, with VOTES_USER_VOTES_CACHE. They are invalidated whenever
+the user votes on the object.
+"""
+from django.core.cache import get_cache
+
+from django_votes import settings as votes_settings
+from django_votes.instrumentation import count
+
+def enabled():
+    return votes_settings.SUMMARY_CACHE is not None
+
+def _cache():
+    return get_cache(votes_settings.SUMMARY_CACHE)
+
+def cache_key(summary_model, object_id):
+    return 'django_votes:%s:%s' % (summary_model.get_model_name(), object_id)
+
+def get_many(summary_model, object_ids):
+    """
+    Return a dict object_id -> summary of the summaries found in the cache.
+    """
+    if not enabled():
+        return {}
+    keys = dict((cache_key(summary_model, object_id), object_id) for object_id in object_ids)
+    found = _cache().get_many(keys.keys())
+    count('summary_cache_hits', len(found))
+    count('summary_cache_misses', len(keys) - len(found))
+    return dict((keys[key], summary_model(**values)) for key, values in found.items())
+
+def set_many(summary_model, summaries):
+    """
+    Store a dict object_id -> summary in the cache.
+    """
+    if enabled() and summaries:
+        # The generated summary models can't be pickled, store their field
+        # values instead.
+        _cache().set_many(dict((cache_key(summary_model, object_id),
+                                dict((field.attname, getattr(summary, field.attname))
+                                     for field in summary_model._meta.fields))
+                               for object_id, summary in summaries.items()),
+                          votes_settings.SUMMARY_CACHE_TIMEOUT)
+
+def invalidate(summary_model, object_ids):
+    """
+    Remove the summaries of the given objects from the cache.
+    """
+    if enabled():
+        _cache().delete_many([cache_key(summary_model, object_id) for object_id in object_ids])
+
+def user_votes_enabled():
+    return votes_settings.USER_VOTES_CACHE is not None
+
+def _user_votes_cache():
+    return get_cache(votes_settings.USER_VOTES_CACHE)
+
+def user_vote_key(vote_model, user_id, object_id):
+    return 'django_votes:user:%s:%s:%s' % (vote_model.get_model_name(), user_id, object_id)
+
+def get_user_votes(vote_model, user_id, object_ids):
+    """
+    Return a dict object_id -> value of the user's votes found in the cache.
+    A value of 0 means the user didn't vote on the object.
+    """
+    if not user_votes_enabled():
+        return {}
+    keys = dict((user_vote_key(vote_model, user_id, object_id), object_id) for object_id in object_ids)
+    found = _user_votes_cache().get_many(keys.keys())
+    count('user_votes_cache_hits', len(found))
+    count('user_votes_cache_misses', len(keys) - len(found))
+    return dict((keys[key], value) for key, value in found.items())
+
+def set_user_votes(vote_model, user_id, votes):
+    """
+    Store a dict object_id -> value of the user's votes in the cache.
+    """
+    if user_votes_enabled() and votes:
+        _user_votes_cache().set_many(dict((user_vote_key(vote_model, user_id, object_id), value)
+                                          for object_id, value in votes.items()),
+                                     votes_settings.USER_VOTES_CACHE_TIMEOUT)
+
+def invalidate_user_votes(vote_model, votes):
+    """
+    Remove the given (user_id, object_id) votes from the cache.
+    """
+    if user_votes_enabled():
+        _user_votes_cache().delete_many([user_vote_key(vote_model, user_id, object_id)
+                                         for user_id, object_id in votes])
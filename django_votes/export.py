@@ -0,0 +1,83 @@
+"""
+Streaming export of the vote, rating and summary tables as CSV or JSON
+Lines, used by the export_votes command and the votes_export view.
+
+Rows are read chunk_size at a time, paginated on the primary key, so
+memory use doesn't depend on the size of the table.
+"""
+import csv
+import json
+from cStringIO import StringIO
+from datetime import datetime, date
+
+FORMATS = ('csv', 'jsonl')
+
+
+def _field_names(model):
+    return [field.attname for field in model._meta.fields]
+
+def _since_field(model):
+    """
+    The column selecting the rows changed since a point in time: updated_on
+    for summaries, the vote date otherwise.
+    """
+    names = _field_names(model)
+    return 'updated_on' if 'updated_on' in names else 'date'
+
+def rows(model, since=None, chunk_size=1000):
+    """
+    Yield the rows of a model as tuples of field values, in primary key
+    order. Only the rows changed since the given datetime when there is one.
+    """
+    fields = _field_names(model)
+    pk_name = model._meta.pk.attname
+    queryset = model.objects.order_by(pk_name)
+    if since is not None:
+        queryset = queryset.filter(**{'%s__gte' % _since_field(model): since})
+
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(**{'%s__gt' % pk_name: last})
+        chunk = list(chunk.values_list(*fields)[:chunk_size])
+        for row in chunk:
+            yield row
+        if len(chunk) < chunk_size:
+            return
+        last = chunk[-1][fields.index(pk_name)]
+
+def _value(value):
+    if isinstance(value, (datetime, date)):
+        return value.isoformat()
+    return value
+
+def csv_lines(model, since=None, chunk_size=1000):
+    """
+    Yield the header and rows of a model as CSV lines.
+    """
+    buffer = StringIO()
+    writer = csv.writer(buffer)
+
+    def line(values):
+        writer.writerow([unicode(_value(value)).encode('utf-8') if value is not None else ''
+                         for value in values])
+        result = buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+        return result
+
+    yield line(_field_names(model))
+    for row in rows(model, since, chunk_size):
+        yield line(row)
+
+def jsonl_lines(model, since=None, chunk_size=1000):
+    """
+    Yield the rows of a model as JSON objects, one per line.
+    """
+    fields = _field_names(model)
+    for row in rows(model, since, chunk_size):
+        yield json.dumps(dict(zip(fields, map(_value, row)))) + '\n'
+
+def lines(model, format='csv', since=None, chunk_size=1000):
+    if format == 'jsonl':
+        return jsonl_lines(model, since, chunk_size)
+    return csv_lines(model, since, chunk_size)
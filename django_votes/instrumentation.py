@@ -0,0 +1,119 @@
+"""
+Timing and query counts of the voting operations, enabled with the
+VOTES_INSTRUMENTATION setting.
+
+Every instrumented operation (saving a vote, reading summaries, the views,
+...) sends the operation_finished signal, with the operation name as
+sender:
+
+    def report(sender, duration, queries, **kwargs):
+        statsd.timing('votes.%s' % sender, duration * 1000)
+
+    operation_finished.connect(report)
+
+VoteMetricsMiddleware adds the operations and counters (summary cache hits
+and misses, rows written) of a request up and logs them.
+
+When VOTES_INSTRUMENTATION is off, which is the default, the operations
+are not wrapped at all.
+"""
+import logging
+import threading
+from functools import wraps
+from timeit import default_timer as timer
+
+from django.conf import settings
+from django.db import connection
+from django.dispatch import Signal
+
+from django_votes import settings as votes_settings
+
+logger = logging.getLogger('django_votes')
+
+operation_finished = Signal(providing_args=['duration', 'queries'])
+
+_local = threading.local()
+
+
+def instrumented(operation):
+    """
+    Decorator measuring the duration and number of queries of each call of
+    the function, reported as the given operation.
+    """
+    def decorator(func):
+        if not votes_settings.INSTRUMENTATION:
+            return func
+
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            # Queries are only logged by debug cursors. Use one for the
+            # duration of the outermost operation, and don't keep the
+            # logged queries when DEBUG is off.
+            debug_cursor = connection.use_debug_cursor
+            connection.use_debug_cursor = True
+            logged = len(connection.queries)
+            start = timer()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                duration = timer() - start
+                queries = len(connection.queries) - logged
+                connection.use_debug_cursor = debug_cursor
+                if not (debug_cursor or (debug_cursor is None and settings.DEBUG)):
+                    del connection.queries[logged:]
+
+                metrics = getattr(_local, 'metrics', None)
+                if metrics is not None:
+                    metrics['operations'].append((operation, duration, queries))
+                operation_finished.send(sender=operation, duration=duration, queries=queries)
+        return wrapper
+    return decorator
+
+def count(counter, n=1):
+    """
+    Add n to a counter of the current request, e.g. count('cache_hits', 3).
+    """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None and n:
+        metrics['counters'][counter] = metrics['counters'].get(counter, 0) + n
+
+def start_collecting():
+    _local.metrics = {'operations': [], 'counters': {}}
+
+def stop_collecting():
+    """
+    Stop collecting the metrics of this thread, and return them.
+    """
+    metrics = getattr(_local, 'metrics', None)
+    _local.metrics = None
+    return metrics
+
+
+class VoteMetricsMiddleware(object):
+    """
+    Logs the voting operations of every request that had any, with their
+    duration and number of queries, and the counters. For instance:
+
+        POST /votes/vote-up/ cast=1 (4.1ms, 3 queries) vote.save=1 (3.2ms, 3 queries)
+        view.up_vote=1 (5.0ms, 4 queries) summary_rows_updated=1
+
+    Needs VOTES_INSTRUMENTATION.
+    """
+    def process_request(self, request):
+        if votes_settings.INSTRUMENTATION:
+            start_collecting()
+
+    def process_response(self, request, response):
+        metrics = stop_collecting()
+        if metrics and (metrics['operations'] or metrics['counters']):
+            totals = {}
+            for operation, duration, queries in metrics['operations']:
+                calls, total_duration, total_queries = totals.get(operation, (0, 0, 0))
+                totals[operation] = (calls + 1, total_duration + duration, total_queries + queries)
+
+            parts = ['%s=%d (%.1fms, %d queries)' % (operation, calls, duration * 1000, queries)
+                     for operation, (calls, duration, queries) in sorted(totals.items())]
+            parts.extend('%s=%d' % item for item in sorted(metrics['counters'].items()))
+            logger.info('%s %s %s', request.method, request.path, ' '.join(parts),
+                        extra={'vote_metrics': metrics})
+        return response
@@ -0,0 +1,256 @@
+"""
+In-process leaderboards: the objects of a vote or rating model ranked by the
+score of their summary (VoteSummary.score, RatingSummary.bayesian_rating).
+
+A leaderboard is loaded from the summary table the first time it is used and
+kept current by the summary updates of this process. Updates made by other
+processes are picked up when it is reloaded, every VOTES_LEADERBOARD_TTL
+seconds.
+"""
+import math
+import random
+import threading
+import time
+
+from django.db.models import Sum
+
+from django_votes import settings as votes_settings
+
+
+class _Node(object):
+    __slots__ = ('value', 'next', 'width')
+
+    def __init__(self, value, levels):
+        self.value = value
+        self.next = [None] * levels
+        self.width = [1] * levels
+
+_NIL = _Node(None, 0)
+
+
+class IndexableSkipList(object):
+    """
+    Sorted list of values with insert, remove, index and access by position
+    in O(log n).
+    """
+    def __init__(self, expected_size=1000):
+        self.size = 0
+        self.maxlevels = int(1 + math.log(max(expected_size, 2), 2))
+        self.head = _Node(None, self.maxlevels)
+        self.head.next = [_NIL] * self.maxlevels
+
+    def __len__(self):
+        return self.size
+
+    def _find(self, value, strict):
+        """
+        The last node on every level before value, and the positions of
+        those nodes.
+        """
+        chain = [None] * self.maxlevels
+        positions = [0] * self.maxlevels
+        node, position = self.head, 0
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level] is not _NIL and \
+                    (node.next[level].value < value if strict else node.next[level].value <= value):
+                position += node.width[level]
+                node = node.next[level]
+            chain[level] = node
+            positions[level] = position
+        return chain, positions
+
+    def insert(self, value):
+        chain, positions = self._find(value, strict=False)
+
+        levels = min(self.maxlevels, 1 - int(math.log(1 - random.random(), 2.0)))
+        new = _Node(value, levels)
+        for level in range(levels):
+            previous = chain[level]
+            steps = positions[0] - positions[level]
+            new.next[level] = previous.next[level]
+            previous.next[level] = new
+            new.width[level] = previous.width[level] - steps
+            previous.width[level] = steps + 1
+        for level in range(levels, self.maxlevels):
+            chain[level].width[level] += 1
+        self.size += 1
+
+    def remove(self, value):
+        chain, positions = self._find(value, strict=True)
+        node = chain[0].next[0]
+        if node is _NIL or node.value != value:
+            raise ValueError('%r is not in the list' % (value,))
+
+        for level in range(len(node.next)):
+            previous = chain[level]
+            previous.width[level] += node.width[level] - 1
+            previous.next[level] = node.next[level]
+        for level in range(len(node.next), self.maxlevels):
+            chain[level].width[level] -= 1
+        self.size -= 1
+
+    def index(self, value):
+        chain, positions = self._find(value, strict=True)
+        node = chain[0].next[0]
+        if node is _NIL or node.value != value:
+            raise ValueError('%r is not in the list' % (value,))
+        return positions[0]
+
+    def slice(self, start, stop):
+        """
+        The values from position start up to stop.
+        """
+        start, stop = max(start, 0), min(stop, self.size)
+        if start >= stop:
+            return []
+
+        # Walk down to the node at position start...
+        node, remaining = self.head, start + 1
+        for level in reversed(range(self.maxlevels)):
+            while node.next[level] is not _NIL and node.width[level] <= remaining:
+                remaining -= node.width[level]
+                node = node.next[level]
+
+        # ... then along the bottom level.
+        values = []
+        while len(values) < stop - start:
+            values.append(node.value)
+            node = node.next[0]
+        return values
+
+
+class Leaderboard(object):
+    """
+    Objects of a summary model ranked by a score field, highest first.
+    """
+    def __init__(self, summary_model, field=None):
+        self.summary_model = summary_model
+        self.field = field or summary_model.ranking_field
+        self.loaded_at = None
+        self._lock = threading.RLock()
+
+    def load(self):
+        """
+        (Re)load all scores from the summary table.
+        """
+        with self._lock:
+            if self.summary_model.shard_model is None:
+                scores = dict(self.summary_model.objects.values_list('object', self.field)
+                                                        .order_by().iterator())
+            else:
+                scores = self._sharded_scores()
+            ranking = IndexableSkipList(expected_size=2 * len(scores))
+            for object_id, score in scores.items():
+                ranking.insert((-score, object_id))
+            self._scores, self._ranking = scores, ranking
+            self.loaded_at = time.time()
+
+    def _sharded_scores(self):
+        """
+        The scores of a sharded summary model, computed from the counters of
+        the rows and their shards: the score column leaves out the shards
+        which aren't folded yet.
+        """
+        summary_model = self.summary_model
+        fields = summary_model.counter_fields
+        summaries = dict((object_id, summary_model(object_id=object_id, **dict(zip(fields, counters))))
+                         for object_id, counters in
+                         ((row[0], row[1:]) for row in summary_model.objects.values_list('object', *fields)
+                                                                         .order_by().iterator()))
+        for row in summary_model.shard_model.objects.values_list('object') \
+                                            .annotate(*[Sum(field) for field in fields]).order_by():
+            summary = summaries.get(row[0])
+            if summary is not None:
+                for field, value in zip(fields, row[1:]):
+                    setattr(summary, field, getattr(summary, field) + (value or 0))
+        scores = {}
+        for object_id, summary in summaries.items():
+            summary.update_derived()
+            scores[object_id] = getattr(summary, self.field)
+        return scores
+
+    def _loaded(self):
+        ttl = votes_settings.LEADERBOARD_TTL
+        if self.loaded_at is None or (ttl is not None and time.time() - self.loaded_at > ttl):
+            self.load()
+
+    def update(self, object_id, score):
+        """
+        Set the score of an object. Does nothing while the leaderboard isn't
+        loaded, it will read the score from the database.
+        """
+        with self._lock:
+            if self.loaded_at is None:
+                return
+            if object_id in self._scores:
+                self._ranking.remove((-self._scores[object_id], object_id))
+            self._scores[object_id] = score
+            self._ranking.insert((-score, object_id))
+
+    def top(self, n=10):
+        """
+        The n best objects, as (object_id, score) pairs.
+        """
+        with self._lock:
+            self._loaded()
+            return [(object_id, -score) for score, object_id in self._ranking.slice(0, n)]
+
+    def rank(self, object_id):
+        """
+        The position of an object, starting at 1, or None when it has no
+        summary.
+        """
+        with self._lock:
+            self._loaded()
+            if object_id not in self._scores:
+                return None
+            return self._ranking.index((-self._scores[object_id], object_id)) + 1
+
+    def around(self, object_id, k=5):
+        """
+        The object with the k objects ranked above and below it, as
+        (rank, object_id, score) tuples.
+        """
+        with self._lock:
+            rank = self.rank(object_id)
+            if rank is None:
+                return []
+            start = max(rank - 1 - k, 0)
+            return [(start + position + 1, other_id, -score) for position, (score, other_id)
+                    in enumerate(self._ranking.slice(start, rank + k))]
+
+
+_leaderboards = {}
+_leaderboards_lock = threading.Lock()
+
+def get_leaderboard(summary_model):
+    """
+    The leaderboard of a summary model, shared by the whole process.
+    """
+    with _leaderboards_lock:
+        if summary_model not in _leaderboards:
+            _leaderboards[summary_model] = Leaderboard(summary_model)
+        return _leaderboards[summary_model]
+
+def loaded(summary_model):
+    """
+    Whether the process keeps a leaderboard of a summary model.
+    """
+    return summary_model in _leaderboards
+
+def update(summary_model, object_id, score):
+    """
+    Called by the summary updates, keeps a loaded leaderboard current.
+    """
+    board = _leaderboards.get(summary_model)
+    if board is not None:
+        board.update(object_id, score)
+
+def reset(summary_model):
+    """
+    Forget the scores of a summary model, after its summaries were rebuilt.
+    """
+    board = _leaderboards.get(summary_model)
+    if board is not None:
+        with board._lock:
+            board.loaded_at = None
@@ -0,0 +1,41 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django_votes import export
+from django_votes.registry import registry, UnknownModel
+from django_votes.utils import parse_since
+
+
+class Command(BaseCommand):
+    args = '<model>'
+    help = ('Export a vote, rating or summary model (e.g. "app.MyModelVote" or '
+            '"app.MyModelVoteSummary") as CSV or JSON Lines')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', default='csv', choices=export.FORMATS,
+                    help='csv (default) or jsonl.'),
+        make_option('--since', dest='since',
+                    help='Only export the votes cast, or the summaries updated, since '
+                         'this date and time (e.g. "2012-05-01 12:00").'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of rows read per query.'),
+        make_option('--output', dest='output',
+                    help='Write to this file instead of the standard output.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Give the name of the model to export')
+        try:
+            model = registry.get(args[0])
+            since = parse_since(options['since']) if options['since'] else None
+        except (UnknownModel, ValueError) as e:
+            raise CommandError(unicode(e))
+
+        output = open(options['output'], 'wb') if options['output'] else self.stdout
+        try:
+            for line in export.lines(model, options['format'], since, options['chunk_size']):
+                output.write(line)
+        finally:
+            if options['output']:
+                output.close()
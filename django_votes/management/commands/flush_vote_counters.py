@@ -0,0 +1,42 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django_votes.registry import registry
+
+
+class Command(BaseCommand):
+    help = ('Write the summary counters kept by the summary backends (e.g. the '
+            'CacheCounterBackend) back to the summary tables')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='append', dest='models', default=[],
+                    help='Only flush the counters of this vote or rating model '
+                         '(e.g. "app.MyModelVote"). Can be given more than once.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Maximum number of logged changes read at once.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep running, flushing the counters every --interval seconds.'),
+        make_option('--interval', type='float', dest='interval', default=5,
+                    help='Seconds to wait between two flushes.'),
+    )
+
+    def handle(self, *args, **options):
+        all_models = registry.models()
+
+        model_names = options['models'] or sorted(all_models)
+        for model_name in model_names:
+            if model_name not in all_models:
+                raise CommandError('No such vote or rating model "%s"' % model_name)
+
+        verbosity = int(options['verbosity'])
+        while True:
+            for model_name in model_names:
+                summary_model = all_models[model_name].get_summary_model()
+                written = summary_model.summary_backend.flush(summary_model, options['batch_size'])
+                if written and verbosity > 1:
+                    self.stdout.write('%s: wrote %d summaries\n' % (model_name, written))
+
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
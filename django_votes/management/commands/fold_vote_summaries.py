@@ -0,0 +1,45 @@
+import time
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django_votes import models, settings as votes_settings
+from django_votes.registry import registry
+
+
+class Command(BaseCommand):
+    help = ('Apply the summary changes logged in deferred mode (VOTES_DEFERRED_SUMMARIES), '
+            'and fold the shards of sharded summaries into their summary rows')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', dest='batch_size', default=10000,
+                    help='Maximum number of logged changes or shards applied per transaction.'),
+        make_option('--loop', action='store_true', dest='loop', default=False,
+                    help='Keep running, folding new changes every --interval seconds.'),
+        make_option('--interval', type='float', dest='interval',
+                    default=votes_settings.DEFERRED_INTERVAL,
+                    help='Seconds to wait when there is nothing left to fold.'),
+    )
+
+    def handle(self, *args, **options):
+        verbosity = int(options['verbosity'])
+        summary_models = [model.get_summary_model() for model in registry.models().values()]
+        sharded = [summary_model for summary_model in summary_models if summary_model.shards]
+        while True:
+            # Fold full batches back to back, then wait for new changes.
+            folded = models.SummaryDelta.objects.fold(options['batch_size'])
+            if folded and verbosity > 1:
+                self.stdout.write('Folded %d summary changes\n' % folded)
+
+            # The stored scores of sharded summaries only count their
+            # shards once these are folded.
+            full = folded >= options['batch_size']
+            for summary_model in sharded:
+                shards = summary_model.objects.fold_shards(options['batch_size'])
+                if shards and verbosity > 1:
+                    self.stdout.write('%s: folded %d shards\n' % (summary_model.get_model_name(), shards))
+                full = full or shards >= options['batch_size']
+
+            if not full:
+                if not options['loop']:
+                    break
+                time.sleep(options['interval'])
@@ -0,0 +1,172 @@
+import csv
+import json
+import sys
+import time
+from collections import defaultdict
+from itertools import islice
+from optparse import make_option
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.utils.timezone import now
+
+from django_votes import cache as summary_cache
+from django_votes.registry import registry, UnknownModel
+from django_votes.utils import bulk_insert, parse_since
+
+
+class Command(BaseCommand):
+    args = '<model> <file>'
+    help = ('Import votes or ratings from a CSV or JSON Lines file ("-" for the standard '
+            'input), then rebuild the summaries of the objects voted on. Every row has an '
+            'object_id, a voter_id (or rater_id), a value and optionally a date.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--format', dest='format', choices=('csv', 'jsonl'),
+                    help='csv or jsonl, by default taken from the file extension.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of rows validated and inserted at once.'),
+        make_option('--duplicates', dest='duplicates', default='skip', choices=('skip', 'overwrite'),
+                    help='What to do with the rows of users who already voted on the object: '
+                         'skip (default) or overwrite their vote.'),
+    )
+
+    def handle(self, *args, **options):
+        if len(args) != 2:
+            raise CommandError('Give the vote or rating model and the file to import')
+        try:
+            model = registry.vote_or_rating_model(args[0])
+        except UnknownModel as e:
+            raise CommandError(unicode(e))
+
+        path = args[1]
+        format = options['format'] or ('jsonl' if path.endswith(('.jsonl', '.json')) else 'csv')
+        input = sys.stdin if path == '-' else open(path, 'rb')
+
+        self.model = model
+        self.voter_field = '%s_id' % model.objects.voter_field
+        self.overwrite = options['duplicates'] == 'overwrite'
+        self.stats = defaultdict(int)
+        verbosity = int(options['verbosity'])
+        chunk_size = options['chunk_size']
+
+        touched = set()
+        started = time.time()
+        try:
+            records = self._records(input, format)
+            while True:
+                chunk = list(islice(records, chunk_size))
+                if not chunk:
+                    break
+                touched.update(self._import_chunk(chunk))
+                if verbosity > 0:
+                    self._progress(started)
+        finally:
+            if input is not sys.stdin:
+                input.close()
+
+        # The summaries and buckets are computed set-based at the end,
+        # rather than updated row by row.
+        touched = sorted(touched)
+        summary_model = model.get_summary_model()
+        for i in range(0, len(touched), chunk_size):
+            object_ids = touched[i:i + chunk_size]
+            summary_model.rebuild(object_ids, batch_size=chunk_size)
+            if summary_model.bucket_model is not None:
+                model.objects.rebuild_buckets(batch_size=chunk_size, object_ids=object_ids)
+
+        if verbosity > 0:
+            self._progress(started)
+            self.stdout.write('Rebuilt the summaries of %d objects\n' % len(touched))
+
+    def _records(self, input, format):
+        if format == 'jsonl':
+            for line in input:
+                if line.strip():
+                    yield json.loads(line)
+        else:
+            for record in csv.DictReader(input):
+                yield record
+
+    def _parse(self, record):
+        """
+        (voter_id, object_id, value, date) of a record, or None when it's
+        invalid.
+        """
+        try:
+            voter_id = record.get(self.voter_field) or record.get('voter_id') or record.get('rater_id')
+            date = record.get('date')
+            if date:
+                date = parse_since(date)
+            return int(voter_id), int(record['object_id']), int(record['value']), date or now()
+        except (KeyError, TypeError, ValueError):
+            return None
+
+    def _import_chunk(self, records):
+        """
+        Validate and insert a chunk of records. Returns the ids of the
+        objects whose votes changed.
+        """
+        stats = self.stats
+        model = self.model
+        stats['read'] += len(records)
+
+        votes = {}
+        for record in records:
+            parsed = self._parse(record)
+            if parsed is None:
+                stats['invalid'] += 1
+                continue
+            voter_id, object_id, value, date = parsed
+            # The last vote of a user on an object wins.
+            votes[(voter_id, object_id)] = (value, date)
+
+        # Check that the objects and users exist, with one query each.
+        object_ids = set(object_id for voter_id, object_id in votes)
+        voter_ids = set(voter_id for voter_id, object_id in votes)
+        valid_objects = set(model.get_owner_model().objects.filter(pk__in=object_ids)
+                                                           .values_list('pk', flat=True))
+        valid_voters = set(User.objects.filter(pk__in=voter_ids).values_list('pk', flat=True))
+        for key in list(votes):
+            if key[0] not in valid_voters or key[1] not in valid_objects:
+                stats['invalid'] += 1
+                del votes[key]
+
+        touched = set()
+        with transaction.commit_on_success():
+            votes_found = model.objects.select_for_update() \
+                                       .filter(object__in=valid_objects,
+                                               **{'%s__in' % model.objects.voter_field: valid_voters}) \
+                                       .values_list('pk', self.voter_field, 'object_id', 'value').order_by()
+            existing = dict(((voter_id, object_id), (pk, value))
+                            for pk, voter_id, object_id, value in votes_found)
+
+            new, changed = [], defaultdict(list)
+            for key, (value, date) in votes.items():
+                if key not in existing:
+                    new.append(model(object_id=key[1], value=value, date=date,
+                                     **{self.voter_field: key[0]}))
+                elif self.overwrite and existing[key][1] != value:
+                    changed[value].append(existing[key][0])
+                else:
+                    stats['skipped'] += 1
+                    continue
+                touched.add(key[1])
+
+            # Raw, to keep the dates of the rows: bulk_create would set the
+            # auto_now_add date to now.
+            bulk_insert(model, new, raw=True)
+            for value, pks in changed.items():
+                model.objects.filter(pk__in=pks).update(value=value)
+
+        stats['inserted'] += len(new)
+        stats['updated'] += sum(len(pks) for pks in changed.values())
+        summary_cache.invalidate_user_votes(model, votes.keys())
+        return touched
+
+    def _progress(self, started):
+        elapsed = time.time() - started
+        self.stdout.write('%(read)d rows read: %(inserted)d inserted, %(updated)d updated, '
+                          '%(skipped)d skipped, %(invalid)d invalid' % self.stats)
+        self.stdout.write(' (%d rows/s)\n' % (self.stats['read'] / elapsed if elapsed else 0))
@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django_votes.registry import registry
+
+
+class Command(BaseCommand):
+    help = 'Recalculate the hourly vote and rating buckets used by trending()'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='append', dest='models', default=[],
+                    help='Only rebuild the buckets of this vote or rating model '
+                         '(e.g. "app.MyModelVote"). Can be given more than once.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of buckets written per INSERT.'),
+    )
+
+    def handle(self, *args, **options):
+        all_models = registry.models()
+
+        model_names = options['models'] or sorted(name for name, model in all_models.items()
+                                                  if model.get_summary_model().bucket_model)
+        for model_name in model_names:
+            if model_name not in all_models:
+                raise CommandError('No such vote or rating model "%s"' % model_name)
+
+        for model_name in model_names:
+            self.stdout.write('Updating: %s\n' % model_name)
+            count = all_models[model_name].objects.rebuild_buckets(batch_size=options['batch_size'])
+            self.stdout.write('Wrote %d buckets\n' % count)
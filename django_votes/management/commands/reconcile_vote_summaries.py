@@ -0,0 +1,96 @@
+import os
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+from django_votes import models
+from django_votes.registry import registry
+from django_votes.utils import parse_since
+
+
+class Command(BaseCommand):
+    help = ('Compare the vote and rating summaries with the votes and ratings '
+            'tables, and rebuild the summaries that drifted')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='append', dest='models', default=[],
+                    help='Only check the summaries of this vote or rating model '
+                         '(e.g. "app.MyModelVote"). Can be given more than once.'),
+        make_option('--since', dest='since',
+                    help='Only check the summaries updated, or with votes cast, '
+                         'since this date and time (e.g. "2012-05-01 12:00").'),
+        make_option('--watermark', dest='watermark',
+                    help='File holding the time of the previous run, used as --since. '
+                         'Updated after every successful run.'),
+        make_option('--chunk-size', type='int', dest='chunk_size', default=1000,
+                    help='Number of summaries compared per query.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Only report the summaries that drifted.'),
+    )
+
+    def handle(self, *args, **options):
+        all_models = registry.models()
+
+        model_names = options['models'] or sorted(all_models)
+        for model_name in model_names:
+            if model_name not in all_models:
+                raise CommandError('No such vote or rating model "%s"' % model_name)
+
+        since = options['since']
+        if options['watermark'] and not since and os.path.exists(options['watermark']):
+            since = open(options['watermark']).read().strip()
+        if since:
+            try:
+                since = parse_since(since)
+            except ValueError as e:
+                raise CommandError(unicode(e))
+
+        # Everything changed from here on is checked by the next run.
+        started = timezone.now()
+        verbosity = int(options['verbosity'])
+
+        for model_name in model_names:
+            vote_model = all_models[model_name]
+            summary_model = vote_model.get_summary_model()
+
+            checked, drifted = 0, []
+            for object_ids in self._chunks(vote_model, summary_model, since, options['chunk_size']):
+                checked += len(object_ids)
+                found = models._drifted_summaries(summary_model, object_ids)
+                if found and not options['dry_run']:
+                    summary_model.rebuild(found)
+                drifted.extend(found)
+
+            self.stdout.write('%s: %d of %d summaries drifted (%.2f%%)%s\n' % (
+                model_name, len(drifted), checked,
+                100.0 * len(drifted) / checked if checked else 0,
+                ', rebuilt' if drifted and not options['dry_run'] else ''))
+            if drifted and verbosity > 1:
+                self.stdout.write('  %s\n' % ', '.join(str(object_id) for object_id in drifted))
+
+        if options['watermark'] and not options['dry_run']:
+            with open(options['watermark'], 'w') as f:
+                f.write(started.isoformat())
+
+    def _chunks(self, vote_model, summary_model, since, chunk_size):
+        """
+        Yield the object ids of the summaries to check, chunk_size at a time.
+        """
+        if since is None:
+            # All summaries, paginated on the object id.
+            last = 0
+            while True:
+                object_ids = list(summary_model.objects.filter(object__gt=last).order_by('object')
+                                                       .values_list('object', flat=True)[:chunk_size])
+                if not object_ids:
+                    return
+                yield object_ids
+                last = object_ids[-1]
+        else:
+            object_ids = set(summary_model.objects.filter(updated_on__gte=since)
+                                                  .values_list('object', flat=True).order_by())
+            object_ids.update(vote_model.objects.filter(date__gte=since)
+                                                .values_list('object', flat=True).order_by())
+            object_ids = sorted(object_ids)
+            for i in range(0, len(object_ids), chunk_size):
+                yield object_ids[i:i + chunk_size]
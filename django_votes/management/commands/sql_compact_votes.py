@@ -0,0 +1,67 @@
+import copy
+import re
+from optparse import make_option
+
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connections, DEFAULT_DB_ALIAS, models
+from django_votes.registry import registry, UnknownModel
+
+
+class Command(BaseCommand):
+    args = '[model ...]'
+    help = ('Print the SQL statements migrating existing vote and rating tables to the '
+            'compact schema of VotesField(compact=True) and RatingsField(compact=True): '
+            'the value column becomes a small integer, and the indexes the models no '
+            'longer declare are dropped. By default for all compact models.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--database', dest='database', default=DEFAULT_DB_ALIAS,
+                    help='The database to print the SQL for. Defaults to the "default" database.'),
+    )
+
+    def handle(self, *args, **options):
+        connection = connections[options['database']]
+        if args:
+            try:
+                vote_models = [registry.vote_or_rating_model(name) for name in args]
+            except UnknownModel as e:
+                raise CommandError(unicode(e))
+        else:
+            all_models = registry.models()
+            vote_models = [all_models[name] for name in sorted(all_models)]
+
+        for model in vote_models:
+            statements = self._statements(model, connection)
+            if statements:
+                self.stdout.write('-- %s\n%s\n' % (model.get_model_name(), '\n'.join(statements)))
+
+    def _statements(self, model, connection):
+        qn = connection.ops.quote_name
+        table = qn(model._meta.db_table)
+        statements = []
+
+        value = model._meta.get_field('value')
+        # sqlite stores both as integers, and can't alter a column.
+        if isinstance(value, models.SmallIntegerField) and connection.vendor != 'sqlite':
+            column_type = value.db_type(connection)
+            if connection.vendor == 'mysql':
+                statements.append('ALTER TABLE %s MODIFY %s %s NOT NULL;' % (table, qn(value.column), column_type))
+            else:
+                statements.append('ALTER TABLE %s ALTER COLUMN %s TYPE %s;' % (table, qn(value.column), column_type))
+
+        for name in ('date', 'object'):
+            field = model._meta.get_field(name)
+            if field.db_index:
+                continue
+            # The name of the index the field had before.
+            indexed = copy.copy(field)
+            indexed.db_index = True
+            for sql in connection.creation.sql_indexes_for_field(model, indexed, no_style()):
+                index = re.match(r'CREATE INDEX (\S+) ON', sql).group(1)
+                if connection.vendor == 'mysql':
+                    statements.append('DROP INDEX %s ON %s;' % (index, table))
+                else:
+                    statements.append('DROP INDEX %s;' % index)
+
+        return statements
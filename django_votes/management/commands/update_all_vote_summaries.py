@@ -1,18 +1,38 @@
-from django.core.management.base import NoArgsCommand
-from django_votes import models
+from optparse import make_option
 
+from django.core.management.base import BaseCommand, CommandError
+from django_votes.registry import registry
 
-class Command(NoArgsCommand):
-    help = 'Recalculate all the vote summaries'
 
-    def handle_noargs(self, **options):
-        for model_name in models._vote_models:
-            print 'Updating: %s' % model_name
-            m = models._vote_models[model_name]
+class Command(BaseCommand):
+    help = 'Recalculate all the vote and rating summaries'
 
-            # Delete existing summaries
-            m.get_summary_model().objects.all()
+    option_list = BaseCommand.option_list + (
+        make_option('--model', action='append', dest='models', default=[],
+                    help='Only rebuild the summaries of this vote or rating model '
+                         '(e.g. "app.MyModelVote"). Can be given more than once.'),
+        make_option('--batch-size', type='int', dest='batch_size', default=1000,
+                    help='Number of summaries written per INSERT.'),
+        make_option('--dry-run', action='store_true', dest='dry_run', default=False,
+                    help='Compute the summaries without writing them.'),
+    )
 
-            # Regenerate summaries by querying every single item again
-            for instance in m.get_owner_model().objects.all():
-                instance.vote_summary
+    def handle(self, *args, **options):
+        all_models = registry.models()
+
+        model_names = options['models'] or sorted(all_models)
+        for model_name in model_names:
+            if model_name not in all_models:
+                raise CommandError('No such vote or rating model "%s"' % model_name)
+
+        for model_name in model_names:
+            summary_model = all_models[model_name].get_summary_model()
+            self.stdout.write('Updating: %s\n' % model_name)
+
+            # Delete existing summaries and regenerate them with one
+            # aggregate query over the votes table.
+            count = summary_model.rebuild(batch_size=options['batch_size'],
+                                          dry_run=options['dry_run'])
+
+            self.stdout.write('%s %d summaries\n' % ('Would write' if options['dry_run'] else 'Wrote',
+                                                      count))
@@ -1,35 +1,946 @@
-from django.db import models
+import math
+import random
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import models, transaction, connections, IntegrityError
+from django.db.models.sql import DeleteQuery
 from django.db.models.base import ModelBase
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.timezone import now
 from django.utils.translation import (ugettext_lazy as _, ugettext)
 from django.contrib.auth.models import User
 from django.db.models.loading import get_model
-from django.db.models import signals, Sum
-from django.core.exceptions import ObjectDoesNotExist
+from django.db.models import signals, Sum, Count, F
+
+from django_votes import cache as summary_cache
+from django_votes.backends import get_backend
+from django_votes import leaderboard as leaderboards
+from django_votes.instrumentation import instrumented, count
+from django_votes.registry import registry
+from django_votes import settings as votes_settings
+from django_votes.utils import bulk_insert
 
 _vote_models = { }
 _rating_models = { }
 
-def handle_rating_deleted(signal, sender, **kwargs):
+@contextmanager
+def _atomic(using=None):
     """
-    When a rating is removed we need to update the summary aswell.
+    Run a block in a transaction of its own, or in a savepoint when the
+    caller already manages a transaction: in Django 1.4 a nested
+    commit_on_success commits or rolls back the whole transaction of the
+    caller.
     """
-    rating = kwargs['instance']
+    if not transaction.is_managed(using=using):
+        with transaction.commit_on_success(using=using):
+            yield
+        return
+
+    sid = transaction.savepoint(using=using)
+    try:
+        yield
+    except:
+        transaction.savepoint_rollback(sid, using=using)
+        raise
+    else:
+        transaction.savepoint_commit(sid, using=using)
+
+def _stored_value(model, pk):
+    """
+    Return the value currently stored for a vote or rating, locking its row
+    until the end of the transaction.
+    """
+    if pk is None:
+        return 0
+    values = list(model.objects.select_for_update().filter(pk=pk).values_list('value', flat=True))
+    return values[0] if values else 0
+
+def _vote_deltas(last_value, value):
+    """
+    Summary deltas for a vote going from last_value to value.
+    """
+    return {'up_votes': int(value == 1) - int(last_value == 1),
+            'down_votes': int(value == -1) - int(last_value == -1)}
+
+def _rating_deltas(last_value, value):
+    """
+    Summary deltas for a rating going from last_value to value. A rating of 0
+    means there is no rating.
+    """
+    return {'rating_total': max(value, 0) - max(last_value, 0),
+            'rating_count': int(value > 0) - int(last_value > 0)}
+
+def _update_summary(summary_model, object_id, deltas, create=True, deferred=None,
+                    shard_key=None):
+    """
+    Add the deltas (field name -> increment) to the summary of an object with
+    a single UPDATE ... SET field = field + delta statement.
 
+    When the object has no summary yet and create is True, the summary is
+    computed from the votes table instead. Returns True when the summary row
+    itself was updated.
+
+    In deferred mode the deltas are only logged, see SummaryDelta. Sharded
+    summaries get the deltas added to one of their shards instead.
+    """
+    deltas = dict((field, delta) for field, delta in deltas.items() if delta)
+    if not deltas:
+        return False
+
+    if deferred is None:
+        deferred = votes_settings.DEFERRED_SUMMARIES
+    if deferred:
+        # Deltas which must not create a summary (deleted votes) are logged
+        # as well, after the deltas of the votes they remove. Without a
+        # summary there is nothing to remove them from: it will be computed
+        # from the votes table, or its object is being deleted.
+        if create or summary_model.objects.filter(object=object_id).exists():
+            SummaryDelta.objects.create(summary_model=summary_model.get_model_name(),
+                                        object_id=object_id, **deltas)
+            count('summary_deltas_logged')
+        return False
+
+    if summary_model.shard_model is not None:
+        if _update_shard(summary_model, object_id, deltas, shard_key):
+            _update_leaderboard(summary_model, object_id)
+            return False
+
+    if _add_to_summary_row(summary_model, object_id, deltas):
+        return True
+    if not create:
+        return False
+
+    sid = transaction.savepoint()
     try:
-        summary = rating.object.rating_summary
-    except ObjectDoesNotExist, e:
-        # This happens when a RatingSummary is going to be deleted, which
-        # causes Rating to be deleted as well.
-        pass
+        _discard_pending(summary_model, [object_id])
+        values = summary_model.compute(object_id)
+        summary_model.objects.create(object_id=object_id, **values)
+    except IntegrityError:
+        # Another transaction created the summary in the meantime.
+        transaction.savepoint_rollback(sid)
+        _add_to_summary_row(summary_model, object_id, deltas)
     else:
-        summary.rating_total -= rating.value
-        summary.rating_count -= 1
-        if summary.rating_count > 0:
-            summary.rating = round(float(summary.rating_total) / float(summary.rating_count), 1)
+        transaction.savepoint_commit(sid)
+        count('summaries_created')
+        leaderboards.update(summary_model, object_id, values[summary_model.ranking_field])
+    return True
+
+def _add_to_summary_row(summary_model, object_id, deltas):
+    """
+    Add deltas to the summary row of an object with
+    UPDATE ... SET field = field + delta, and recalculate the derived fields
+    (average, scores) in the same UPDATE. The counters are read with
+    SELECT ... FOR UPDATE first, so the derived fields match the counters.
+    Returns False when the object has no summary row.
+    """
+    fields = summary_model.counter_fields
+    rows = list(summary_model.objects.select_for_update().filter(object=object_id)
+                                     .values_list(*fields))
+    if not rows:
+        return False
+
+    summary = summary_model(**dict(zip(fields, rows[0])))
+    for field, delta in deltas.items():
+        setattr(summary, field, getattr(summary, field) + delta)
+    summary.update_derived()
+
+    updates = dict((field, F(field) + delta) for field, delta in deltas.items())
+    updates.update((field, getattr(summary, field)) for field in summary_model.derived_fields)
+    updates['updated_on'] = now()
+    summary_model.objects.filter(object=object_id).update(**updates)
+    count('summary_rows_updated')
+    _update_leaderboard(summary_model, object_id, summary)
+    return True
+
+def _update_leaderboard(summary_model, object_id, summary=None):
+    """
+    Update the score of an object in the leaderboard of the process, if
+    there is one. The score of a sharded summary is computed from its row
+    and its shards, the score stored in the row leaves out the shards which
+    aren't folded yet.
+    """
+    if not leaderboards.loaded(summary_model):
+        return
+    if summary_model.shard_model is not None:
+        summaries = dict((s.object_id, s) for s in
+                         summary_model.objects.filter(object=object_id).order_by())
+        summary_model.objects._add_shards(summaries)
+        summary = summaries.get(object_id)
+        if summary is None:
+            return
+    leaderboards.update(summary_model, object_id, getattr(summary, summary_model.ranking_field))
+
+def _increment(model, object_id, deltas, create=True, **lookup):
+    """
+    Add deltas to the counters of the row of an object matching lookup,
+    creating the row when there is none and create is True. Returns False
+    when there was no row to add them to.
+    """
+    updates = dict((field, F(field) + delta) for field, delta in deltas.items() if delta)
+    if not updates:
+        return True
+    if model.objects.filter(object=object_id, **lookup).update(**updates):
+        return True
+    if not create:
+        return False
+
+    sid = transaction.savepoint()
+    try:
+        model.objects.create(object_id=object_id, **dict(lookup, **deltas))
+    except IntegrityError:
+        # Another transaction created the row in the meantime.
+        transaction.savepoint_rollback(sid)
+        model.objects.filter(object=object_id, **lookup).update(**updates)
+    else:
+        transaction.savepoint_commit(sid)
+    return True
+
+def _shard(summary_model, shard_key=None):
+    """
+    The shard picked by shard_key (e.g. the voter id), or a random one.
+    """
+    if shard_key is None:
+        return random.randrange(summary_model.shards)
+    return shard_key % summary_model.shards
+
+def _update_shard(summary_model, object_id, deltas, shard_key=None):
+    """
+    Add deltas to one of the shards of a summary, picked by shard_key (e.g.
+    the voter id) or at random. Returns False when the object has no
+    summary yet; shards only exist next to a summary row.
+    """
+    shard_model = summary_model.shard_model
+    shard = _shard(summary_model, shard_key)
+
+    updates = dict((field, F(field) + delta) for field, delta in deltas.items())
+    if shard_model.objects.filter(object=object_id, shard=shard).update(**updates):
+        count('shard_rows_updated')
+        return True
+    if not summary_model.objects.filter(object=object_id).exists():
+        return False
+
+    _increment(shard_model, object_id, deltas, shard=shard)
+    return True
+
+def _hour(date):
+    return date.replace(minute=0, second=0, microsecond=0)
+
+def _update_buckets(summary_model, deltas, create=True, deferred=None, shard_key=None):
+    """
+    Add deltas ((object_id, hour) -> {field: delta}) to the time buckets of
+    a summary model, if it has any. Buckets are only created when create is
+    True.
+
+    Like the summaries, the buckets only get their deltas logged in deferred
+    mode, and the buckets of sharded summaries are sharded as well: the
+    votes on a popular object don't all wait for the lock on its bucket of
+    the current hour.
+    """
+    bucket_model = summary_model.bucket_model
+    if bucket_model is None:
+        return
+    if deferred is None:
+        deferred = votes_settings.DEFERRED_SUMMARIES
+
+    for (object_id, hour), bucket_deltas in deltas.items():
+        bucket_deltas = dict((field, delta) for field, delta in bucket_deltas.items() if delta)
+        if not bucket_deltas:
+            continue
+        if deferred:
+            if create or bucket_model.objects.filter(object=object_id, hour=hour).exists():
+                SummaryDelta.objects.create(summary_model=summary_model.get_model_name(),
+                                            object_id=object_id, hour=hour, **bucket_deltas)
+                count('summary_deltas_logged')
+        elif summary_model.shards:
+            # A shard is created for deleted votes too, when their hour was
+            # counted in another shard.
+            shard = _shard(summary_model, shard_key)
+            if not _increment(bucket_model, object_id, bucket_deltas, False, hour=hour, shard=shard) and \
+                    (create or bucket_model.objects.filter(object=object_id, hour=hour).exists()):
+                _increment(bucket_model, object_id, bucket_deltas, hour=hour, shard=shard)
         else:
-            summary.rating = 0
+            _increment(bucket_model, object_id, bucket_deltas, create, hour=hour)
+
+def _create_counter_model(summary_model, suffix, keys):
+    """
+    Create a model holding extra counters for a summary model, one row per
+    object and keys ((name, field) pairs): the shards of the summary (see
+    VotesField(shards=...)) or its hourly buckets (see
+    VotesField(buckets=True)).
+    """
+    class Meta:
+        unique_together = (('object',) + tuple(key for key, key_field in keys),)
+        verbose_name = '%s %s' % (summary_model._meta.verbose_name, suffix)
+        verbose_name_plural = '%s %ss' % (summary_model._meta.verbose_name, suffix)
+
+    attrs = {'__module__': summary_model.__module__,
+             'Meta': Meta,
+             'object': models.ForeignKey(summary_model._meta.get_field('object').rel.to,
+                                         verbose_name=_('object'))}
+    attrs.update(keys)
+    for field in summary_model.counter_fields:
+        attrs[field] = models.IntegerField(default=0,
+                                           verbose_name=summary_model._meta.get_field(field).verbose_name)
+
+    return ModelBase('%s%s' % (summary_model._meta.object_name, suffix), (models.Model,), attrs)
+
+def _shard_keys():
+    return [('shard', models.PositiveSmallIntegerField(verbose_name=_('shard')))]
+
+def _bucket_keys(shards):
+    """
+    The keys of the hourly buckets, which are sharded like their summaries.
+    """
+    keys = [('hour', models.DateTimeField(db_index=True, verbose_name=_('hour')))]
+    if shards:
+        keys.append(('shard', models.PositiveSmallIntegerField(default=0, verbose_name=_('shard'))))
+    return keys
+
+def _delete_by_object(model, object_ids=None, field='object'):
+    """
+    Delete the rows of the given objects, or all rows, without loading
+    them first.
+    """
+    using = model.objects.db
+    if object_ids is None:
+        connections[using].cursor().execute('DELETE FROM %s' %
+                connections[using].ops.quote_name(model._meta.db_table))
+    else:
+        DeleteQuery(model).delete_batch(list(object_ids), using,
+                                        field=model._meta.get_field(field))
+    transaction.set_dirty(using)
+
+class SummaryDeltaManager(models.Manager):
+    """
+    Manager of the SummaryDelta log.
+    """
+    @instrumented('summary.fold')
+    def fold(self, batch_size=10000):
+        """
+        Apply up to batch_size logged deltas to the summaries, with one
+        UPDATE per object (and per hourly bucket), and delete them. Returns
+        the number of deltas that were folded.
+        """
+        summary_models = {}
+        for vote_model in _vote_models.values():
+            summary_model = vote_model.get_summary_model()
+            summary_models[summary_model.get_model_name()] = (summary_model, summary_model.add_votes)
+        for rating_model in _rating_models.values():
+            summary_model = rating_model.get_summary_model()
+            summary_models[summary_model.get_model_name()] = (summary_model, summary_model.add_ratings)
+
+        fields = ('up_votes', 'down_votes', 'rating_total', 'rating_count')
+        totals = defaultdict(lambda: defaultdict(int))
+
+        with _atomic():
+            # Locked, so that concurrent workers don't fold the same deltas.
+            rows = list(self.select_for_update().order_by('id')
+                            .values_list('id', 'summary_model', 'object_id', 'hour', *fields)[:batch_size])
+            for row in rows:
+                for field, delta in zip(fields, row[4:]):
+                    if delta:
+                        totals[(row[1], row[2], row[3])][field] += delta
+
+            for (model_name, object_id, hour), deltas in totals.items():
+                if model_name not in summary_models:
+                    continue
+                if hour is None:
+                    summary_models[model_name][1](object_id, deferred=False, **deltas)
+                else:
+                    _update_buckets(summary_models[model_name][0], {(object_id, hour): deltas},
+                                    deferred=False)
+
+            if rows:
+                DeleteQuery(self.model).delete_batch([row[0] for row in rows], self.db)
+                transaction.set_dirty(self.db)
+
+        for model_name, object_id, hour in totals:
+            if model_name in summary_models and hour is None:
+                summary_cache.invalidate(summary_models[model_name][0], [object_id])
+        return len(rows)
+
+class SummaryDelta(models.Model):
+    """
+    A change to a vote or rating summary which hasn't been applied yet. Only
+    used when VOTES_DEFERRED_SUMMARIES is enabled.
+    """
+    summary_model = models.CharField(max_length=255, verbose_name=_('summary model'))
+    object_id = models.PositiveIntegerField(db_index=True, verbose_name=_('object id'))
+    up_votes = models.IntegerField(default=0, verbose_name=_('up votes'))
+    down_votes = models.IntegerField(default=0, verbose_name=_('down votes'))
+    rating_total = models.IntegerField(default=0, verbose_name=_('Rating total'))
+    rating_count = models.IntegerField(default=0, verbose_name=_('Rating count'))
+    # Set for the changes of the hourly buckets (see VotesField(buckets=True)).
+    hour = models.DateTimeField(null=True, blank=True, verbose_name=_('hour'))
+
+    objects = SummaryDeltaManager()
+
+    class Meta:
+        verbose_name = _('Summary delta')
+        verbose_name_plural = _('Summary deltas')
+
+    def __unicode__(self):
+        return u'%s %s' % (self.summary_model, self.object_id)
+
+def _discard_pending(summary_model, object_ids=None):
+    """
+    Drop the logged deltas, the shards and the backend counters of summaries
+    which are about to be computed from the votes table, that already counts
+    the votes behind them.
+    """
+    if votes_settings.DEFERRED_SUMMARIES:
+        pending = SummaryDelta.objects.filter(summary_model=summary_model.get_model_name(),
+                                              hour__isnull=True)
+        if object_ids is not None:
+            pending = pending.filter(object_id__in=object_ids)
+        pending.delete()
+
+    if summary_model.shard_model is not None:
+        _delete_by_object(summary_model.shard_model, object_ids)
+    summary_model.summary_backend.discard(summary_model, object_ids)
+
+@instrumented('summary.rebuild')
+def _rebuild_summaries(summary_model, object_ids=None, batch_size=1000, dry_run=False):
+    """
+    Recompute summaries from the votes table with one GROUP BY query and
+    write them back with bulk_create, at most batch_size rows at a time. All
+    summaries are rebuilt when object_ids is None.
+
+    Returns the number of summaries computed.
+    """
+    computed = 0
+    with _atomic():
+        if not dry_run:
+            _discard_pending(summary_model, object_ids)
+            _delete_by_object(summary_model, object_ids)
+
+        batch = []
+        for object_id, values in summary_model.aggregate(object_ids):
+            batch.append(summary_model(object_id=object_id, **values))
+            if len(batch) >= batch_size:
+                computed += len(batch)
+                if not dry_run:
+                    bulk_insert(summary_model, batch, batch_size)
+                batch = []
+        computed += len(batch)
+        if batch and not dry_run:
+            bulk_insert(summary_model, batch, batch_size)
+
+    if not dry_run:
+        leaderboards.reset(summary_model)
+    if object_ids is not None and not dry_run:
+        summary_cache.invalidate(summary_model, object_ids)
+    return computed
+
+def _drifted_summaries(summary_model, object_ids):
+    """
+    The objects among object_ids whose summary counters don't match the
+    votes table, compared with one GROUP BY query. Objects without a summary
+    are skipped, their summary is computed when it's first read, and so are
+    objects with logged deltas which weren't folded yet.
+    """
+    summaries = dict((s.object_id, s) for s in
+                     summary_model.objects.filter(object__in=object_ids).order_by())
+    if votes_settings.DEFERRED_SUMMARIES:
+        for object_id in SummaryDelta.objects.filter(summary_model=summary_model.get_model_name(),
+                                                     object_id__in=summaries.keys(), hour__isnull=True) \
+                                             .values_list('object_id', flat=True):
+            summaries.pop(object_id, None)
+    if not summaries:
+        return []
+    summary_model.objects._add_shards(summaries)
+
+    computed = dict(summary_model.aggregate(summaries.keys()))
+    return sorted(object_id for object_id, summary in summaries.items()
+                  if any(getattr(summary, field) != computed.get(object_id, {}).get(field, 0)
+                         for field in summary_model.counter_fields))
+
+def _average(total, count):
+    return round(float(total) / float(count), 1) if count > 0 else 0
+
+def _wilson_lower_bound(up_votes, down_votes):
+    """
+    Lower bound of the Wilson score interval for the share of up votes:
+    the share of up votes we are fairly sure an object deserves, given how
+    few votes it may have.
+    """
+    n = up_votes + down_votes
+    if n <= 0:
+        return 0
+    z = votes_settings.WILSON_Z
+    p = float(up_votes) / n
+    return (p + z * z / (2 * n) - z * math.sqrt((p * (1 - p) + z * z / (4 * n)) / n)) / (1 + z * z / n)
+
+def _bayesian_average(total, count):
+    """
+    Average rating pulled towards VOTES_RATING_PRIOR_MEAN, as if every object
+    also had VOTES_RATING_PRIOR_WEIGHT ratings of that value.
+    """
+    weight = votes_settings.RATING_PRIOR_WEIGHT
+    if count + weight <= 0:
+        return 0
+    return (votes_settings.RATING_PRIOR_MEAN * weight + total) / float(weight + count)
+
+@instrumented('vote.delete')
+def handle_vote_deleted(signal, sender, **kwargs):
+    """
+    When a vote is removed we need to update the summary aswell.
+    """
+    vote = kwargs['instance']
+
+    # Don't create a summary here: when the voted object is being deleted,
+    # its VoteSummary is deleted as well.
+    deltas = _vote_deltas(vote.value, 0)
+    sender.get_summary_model().add_votes(vote.object_id, create=False, **deltas)
+    _update_buckets(sender.get_summary_model(), {(vote.object_id, _hour(vote.date)): deltas},
+                    create=False, shard_key=vote.voter_id)
+    summary_cache.invalidate(sender.get_summary_model(), [vote.object_id])
+    summary_cache.invalidate_user_votes(sender, [(vote.voter_id, vote.object_id)])
+
+@instrumented('rating.delete')
+def handle_rating_deleted(signal, sender, **kwargs):
+    """
+    When a rating is removed we need to update the summary aswell.
+    """
+    rating = kwargs['instance']
+
+    # Don't create a summary here: when the rated object is being deleted,
+    # its RatingSummary is deleted as well.
+    deltas = _rating_deltas(rating.value, 0)
+    sender.get_summary_model().add_ratings(rating.object_id, create=False, **deltas)
+    _update_buckets(sender.get_summary_model(), {(rating.object_id, _hour(rating.date)): deltas},
+                    create=False, shard_key=rating.rater_id)
+    summary_cache.invalidate(sender.get_summary_model(), [rating.object_id])
+    summary_cache.invalidate_user_votes(sender, [(rating.rater_id, rating.object_id)])
+
+class SummaryManager(models.Manager):
+    """
+    Manager of the generated summary models.
+    """
+    def __init__(self, cache_name):
+        super(SummaryManager, self).__init__()
+        # Attribute under which owner instances cache their summary.
+        self.cache_name = cache_name
+
+    @instrumented('summary.get_many')
+    def get_many(self, object_ids, create=True):
+        """
+        Return a dict object_id -> summary, read through the summary backend
+        of the model (see django_votes.backends). Missing summaries are
+        computed from the votes table, unless create is False.
+        """
+        return self.model.summary_backend.get_many(self.model, object_ids, create)
+
+    def get_from_database(self, object_ids, create=True):
+        """
+        Return a dict object_id -> summary. Summaries are taken from the
+        cache when possible, the others are read with one query. Missing
+        summaries are computed from the votes table and inserted in bulk.
+        """
+        object_ids = set(object_ids)
+        cached = summary_cache.get_many(self.model, object_ids)
+
+        summaries = dict((s.object_id, s) for s in
+                         self.filter(object__in=object_ids.difference(cached)).order_by())
+
+        missing = object_ids.difference(cached, summaries)
+        if missing and create:
+            with _atomic():
+                sid = transaction.savepoint()
+                try:
+                    _discard_pending(self.model, missing)
+                    computed = dict(self.model.aggregate(missing))
+                    new = [self.model(object_id=object_id, **computed.get(object_id, {}))
+                           for object_id in missing]
+                    # Objects without votes get the derived fields of no
+                    # votes (e.g. the prior of bayesian_rating), not 0.
+                    for summary in new:
+                        summary.update_derived()
+                    bulk_insert(self.model, new)
+                except IntegrityError:
+                    # Some of them were created in the meantime.
+                    transaction.savepoint_rollback(sid)
+                else:
+                    transaction.savepoint_commit(sid)
+                    count('summaries_created', len(missing))
+            # Read them back, bulk_create doesn't set primary keys.
+            for summary in self.filter(object__in=missing).order_by():
+                summaries[summary.object_id] = summary
+                leaderboards.update(self.model, summary.object_id,
+                                    getattr(summary, self.model.ranking_field))
+
+        self._add_shards(summaries)
+        summary_cache.set_many(self.model, summaries)
+        summaries.update(cached)
+        return summaries
+
+    def store_many(self, summaries):
+        """
+        Write summaries (object_id -> summary) kept outside of the table to
+        it, in one transaction: the existing rows are updated and the others
+        inserted in bulk. Their shards are folded into them. Returns the
+        number of summaries written.
+        """
+        if not summaries:
+            return 0
+        fields = self.model.counter_fields + self.model.derived_fields
+        updated_on = now()
+        with _atomic():
+            existing = set(self.select_for_update().filter(object__in=summaries.keys())
+                               .values_list('object', flat=True).order_by())
+            # Objects deleted since are left out.
+            owner_model = self.model._meta.get_field('object').rel.to
+            alive = set(owner_model._default_manager.filter(pk__in=set(summaries).difference(existing))
+                                                    .values_list('pk', flat=True))
+            new = [self.model(object_id=object_id, **dict((field, getattr(summary, field)) for field in fields))
+                   for object_id, summary in summaries.items() if object_id in alive]
+            # A summary created in the meantime fails the whole transaction,
+            # the next flush writes it again.
+            bulk_insert(self.model, new)
+            count('summaries_created', len(new))
+
+            if self.model.shard_model is not None:
+                _delete_by_object(self.model.shard_model, existing)
+            for object_id in existing:
+                summary = summaries[object_id]
+                self.filter(object=object_id).update(updated_on=updated_on,
+                                                     **dict((field, getattr(summary, field)) for field in fields))
+            count('summary_rows_updated', len(existing))
+
+        summary_cache.invalidate(self.model, summaries.keys())
+        return len(existing) + len(new)
+
+    @instrumented('summary.fold_shards')
+    def fold_shards(self, batch_size=10000):
+        """
+        Add up to batch_size shard rows to their summary rows, with one
+        UPDATE per object which also recomputes the derived fields (average,
+        scores), and delete them. The shards are locked while they are
+        folded. Returns the number of shard rows that were folded.
+        """
+        shard_model = self.model.shard_model
+        if shard_model is None:
+            return 0
+        fields = self.model.counter_fields
+        totals = defaultdict(lambda: defaultdict(int))
+
+        with _atomic():
+            rows = list(shard_model.objects.select_for_update().order_by('object', 'shard')
+                                           .values_list('id', 'object', *fields)[:batch_size])
+            for row in rows:
+                for field, value in zip(fields, row[2:]):
+                    if value:
+                        totals[row[1]][field] += value
+
+            # Deleted first, the leaderboard adds the remaining shards to the
+            # updated rows.
+            if rows:
+                DeleteQuery(shard_model).delete_batch([row[0] for row in rows], self.db)
+                transaction.set_dirty(self.db)
+
+            for object_id, deltas in totals.items():
+                _add_to_summary_row(self.model, object_id, deltas)
+
+        summary_cache.invalidate(self.model, totals.keys())
+        return len(rows)
+
+    def _add_shards(self, summaries):
+        """
+        Add the counters of the shards to summaries (object_id -> summary),
+        with one query.
+        """
+        shard_model = self.model.shard_model
+        if shard_model is None or not summaries:
+            return
+        fields = self.model.counter_fields
+        for row in shard_model.objects.filter(object__in=summaries.keys()) \
+                                      .values_list('object').annotate(*[Sum(field) for field in fields]) \
+                                      .order_by():
+            summary = summaries[row[0]]
+            for field, value in zip(fields, row[1:]):
+                setattr(summary, field, getattr(summary, field) + (value or 0))
+            summary.update_derived()
+
+    def prefetch(self, objects):
+        """
+        Load the summaries of a list of owner objects with one query and
+        cache them on the objects, so that reading their summary property
+        doesn't query the database anymore. Returns the objects as a list.
+        """
+        objects = list(objects)
+        summaries = self.get_many(obj.pk for obj in objects)
+        for obj in objects:
+            setattr(obj, self.cache_name, summaries[obj.pk])
+        return objects
+
+    def forget(self, obj):
+        """
+        Drop the summary cached on an owner object.
+        """
+        obj.__dict__.pop(self.cache_name, None)
+
+class VoteManager(models.Manager):
+    """
+    Manager of the generated Vote models.
+    """
+    voter_field = 'voter'
+    trending_field = 'up_votes'
 
-        summary.save()
+    def summary_deltas(self, last_value, value):
+        return _vote_deltas(last_value, value)
+
+    def add_to_summary(self, object_id, deltas, create=True):
+        self.model.get_summary_model().add_votes(object_id, create=create, **deltas)
+
+    @instrumented('cast')
+    def cast(self, voter, object_id, value):
+        """
+        Cast a vote, or change the value of the voter's existing vote on the
+        object. The vote is inserted right away; the unique (object, voter)
+        index tells whether there already was one. Returns the vote.
+        """
+        lookup = {'object': object_id, self.voter_field: voter}
+        with _atomic():
+            sid = transaction.savepoint()
+            try:
+                vote = self.create(object_id=object_id, value=value,
+                                   **{self.voter_field: voter})
+            except IntegrityError:
+                # Already voted. Only the insert is rolled back, not the
+                # rest of the caller's transaction.
+                transaction.savepoint_rollback(sid)
+            else:
+                transaction.savepoint_commit(sid)
+                return vote
+
+            vote = self.get(**lookup)
+            if vote.value != value:
+                vote.value = value
+                vote.save()
+            return vote
+
+    @instrumented('bulk_cast')
+    def bulk_cast(self, votes, batch_size=500):
+        """
+        Cast many votes at once. votes is an iterable of
+        (voter_id, object_id, value) tuples; a voter who already voted on an
+        object gets their vote changed.
+
+        Votes are inserted with bulk_create, at most batch_size at a time,
+        and the summary of every affected object is updated only once, at
+        the end.
+        """
+        voter_field = self.voter_field
+        deltas = defaultdict(lambda: defaultdict(int))
+        bucket_deltas = defaultdict(lambda: defaultdict(int))
+
+        def cast_batch(batch):
+            existing = {}
+            for pk, voter_id, object_id, value, date in self.select_for_update() \
+                    .filter(object__in=set(o for v, o in batch),
+                            **{'%s__in' % voter_field: set(v for v, o in batch)}) \
+                    .values_list('pk', '%s_id' % voter_field, 'object_id', 'value', 'date').order_by():
+                existing[(voter_id, object_id)] = (pk, value, date)
+
+            new, changed = [], defaultdict(list)
+            for key, value in batch.items():
+                voter_id, object_id = key
+                if key in existing:
+                    pk, last_value, date = existing[key]
+                    if last_value == value:
+                        continue
+                    changed[value].append(pk)
+                else:
+                    last_value, date = 0, now()
+                    new.append(self.model(object_id=object_id, value=value,
+                                          **{'%s_id' % voter_field: voter_id}))
+                for field, delta in self.summary_deltas(last_value, value).items():
+                    deltas[object_id][field] += delta
+                    bucket_deltas[(object_id, _hour(date))][field] += delta
+
+            bulk_insert(self.model, new)
+            count('votes_inserted', len(new))
+            for value, pks in changed.items():
+                count('votes_updated', self.filter(pk__in=pks).update(value=value))
+
+        voted = set()
+        with _atomic():
+            batch = {}
+            for voter_id, object_id, value in votes:
+                voted.add((voter_id, object_id))
+                batch[(voter_id, object_id)] = value
+                if len(batch) >= batch_size:
+                    cast_batch(batch)
+                    batch = {}
+            if batch:
+                cast_batch(batch)
+
+            for object_id, object_deltas in deltas.items():
+                self.add_to_summary(object_id, object_deltas)
+            _update_buckets(self.model.get_summary_model(), bucket_deltas)
+
+        summary_cache.invalidate(self.model.get_summary_model(), deltas.keys())
+        summary_cache.invalidate_user_votes(self.model, voted)
+
+    def user_votes(self, user, object_ids):
+        """
+        The votes of a user on the given objects, as a dict object_id ->
+        value, read with one query. Objects the user didn't vote on are left
+        out.
+        """
+        object_ids = set(object_ids)
+        user_id = getattr(user, 'pk', user)
+        votes = summary_cache.get_user_votes(self.model, user_id, object_ids)
+
+        missing = object_ids.difference(votes)
+        if missing:
+            found = dict.fromkeys(missing, 0)
+            found.update(self.filter(object__in=missing, **{self.voter_field: user_id})
+                             .values_list('object', 'value').order_by())
+            # Also cache that the user didn't vote on the others.
+            summary_cache.set_user_votes(self.model, user_id, found)
+            votes.update(found)
+
+        return dict((object_id, value) for object_id, value in votes.items() if value)
+
+    def retract(self, voter, object_id):
+        """
+        Remove the voter's vote on the object, if any. Returns True when
+        there was a vote.
+        """
+        return bool(self.bulk_delete(self.filter(object=object_id,
+                                                 **{self.voter_field: voter})))
+
+    @instrumented('bulk_delete')
+    def bulk_delete(self, votes):
+        """
+        Delete a queryset of votes, e.g. all the votes of a banned user, and
+        update the summaries of the objects they were on.
+
+        Unlike votes.delete(), the votes aren't loaded as model instances and
+        no post_delete signal is sent for them. Their values are read with
+        one query, and every affected summary is updated once. Returns the
+        number of deleted votes.
+        """
+        summary_model = self.model.get_summary_model()
+        deltas = defaultdict(lambda: defaultdict(int))
+        bucket_deltas = defaultdict(lambda: defaultdict(int))
+        pks, deleted = [], set()
+
+        with _atomic():
+            for pk, voter_id, object_id, value, date in votes.select_for_update().order_by() \
+                    .values_list('pk', '%s_id' % self.voter_field, 'object_id', 'value', 'date') \
+                    .iterator():
+                pks.append(pk)
+                deleted.add((voter_id, object_id))
+                for field, delta in self.summary_deltas(value, 0).items():
+                    deltas[object_id][field] += delta
+                    bucket_deltas[(object_id, _hour(date))][field] += delta
+
+            if pks:
+                DeleteQuery(self.model).delete_batch(pks, self.db)
+                transaction.set_dirty(self.db)
+            count('votes_deleted', len(pks))
+
+            for object_id, object_deltas in deltas.items():
+                self.add_to_summary(object_id, object_deltas, create=False)
+            _update_buckets(summary_model, bucket_deltas, create=False)
+
+        summary_cache.invalidate(summary_model, deltas.keys())
+        summary_cache.invalidate_user_votes(self.model, deleted)
+        return len(pks)
+
+    def _bucket_model(self):
+        bucket_model = self.model.get_summary_model().bucket_model
+        if bucket_model is None:
+            raise ImproperlyConfigured('%s keeps no hourly buckets, declare its field with buckets=True'
+                                       % self.model.get_model_name())
+        return bucket_model
+
+    def leaderboard(self):
+        """
+        The objects ranked by the score of their summary, see
+        django_votes.leaderboard.Leaderboard.
+        """
+        return leaderboards.get_leaderboard(self.model.get_summary_model())
+
+    def trending(self, window=timedelta(hours=24), limit=50, order_by=None):
+        """
+        The objects with the highest counts within the last window of time,
+        read from the hourly buckets with one query. Returns a list of
+        (object_id, {field: count}) pairs, ordered by the given counter
+        field (trending_field by default).
+        """
+        bucket_model = self._bucket_model()
+        fields = self.model.get_summary_model().counter_fields
+        order_by = order_by or self.trending_field
+
+        rows = bucket_model.objects.filter(hour__gte=_hour(now() - window)) \
+                                   .values_list('object') \
+                                   .annotate(*[Sum(field) for field in fields]) \
+                                   .order_by('-%s__sum' % order_by)[:limit]
+        return [(row[0], dict(zip(fields, row[1:]))) for row in rows]
+
+    def rebuild_buckets(self, batch_size=1000, object_ids=None):
+        """
+        Recompute the hourly buckets of the given objects, or of all
+        objects, from the votes. Returns the number of buckets written.
+        """
+        bucket_model = self._bucket_model()
+        written = 0
+        with _atomic():
+            _delete_by_object(bucket_model, object_ids)
+            if votes_settings.DEFERRED_SUMMARIES:
+                # The logged changes of the buckets are counted from the votes.
+                summary_model_name = self.model.get_summary_model().get_model_name()
+                pending = SummaryDelta.objects.filter(summary_model=summary_model_name, hour__isnull=False)
+                if object_ids is not None:
+                    pending = pending.filter(object_id__in=object_ids)
+                pending.delete()
+
+            votes = self.all() if object_ids is None else self.filter(object__in=object_ids)
+            batch = []
+            rows = votes.values_list('object', 'date', 'value').order_by('object').iterator()
+            for object_id, votes in groupby(rows, itemgetter(0)):
+                buckets = defaultdict(lambda: defaultdict(int))
+                for _object_id, date, value in votes:
+                    for field, delta in self.summary_deltas(0, value).items():
+                        buckets[_hour(date)][field] += delta
+                batch.extend(bucket_model(object_id=object_id, hour=hour, **counters)
+                             for hour, counters in buckets.items())
+
+                if len(batch) >= batch_size:
+                    bulk_insert(bucket_model, batch, batch_size)
+                    written += len(batch)
+                    batch = []
+            bulk_insert(bucket_model, batch, batch_size)
+            written += len(batch)
+        return written
+
+
+class RatingManager(VoteManager):
+    """
+    Manager of the generated Rating models.
+    """
+    voter_field = 'rater'
+    trending_field = 'rating_count'
+
+    def summary_deltas(self, last_value, value):
+        return _rating_deltas(last_value, value)
+
+    def add_to_summary(self, object_id, deltas, create=True):
+        self.model.get_summary_model().add_ratings(object_id, create=create, **deltas)
+
+    def bulk_rate(self, ratings, batch_size=500):
+        """
+        Rate many objects at once. ratings is an iterable of
+        (rater_id, object_id, value) tuples, see bulk_cast.
+        """
+        return self.bulk_cast(ratings, batch_size)
 
 class VotesField(object):
     """
@@ -38,9 +949,30 @@ class VotesField(object):
     class MyModel(models.Model):
         ...
         Votes = VotesField()
+
+    To spread the writes of very popular objects over several rows, give the
+    number of counter shards per object: VotesField(shards=8).
+
+    VotesField(buckets=True) also keeps hourly vote counts, for
+    MyModel.votes.trending().
+
+    VotesField(compact=True) stores votes in a smaller table for very large
+    numbers of votes: the value is a small integer, the date and object
+    columns have no index of their own (the unique (object, voter) index
+    serves the lookups by object) and votes have no default ordering.
+    date_index=True keeps the date index.
+
+    The summary counters are kept by the backend of VOTES_SUMMARY_BACKEND,
+    or of the dotted path given as summary_backend, see
+    django_votes.backends.
     """
-    def __init__(self):
-        pass
+    def __init__(self, shards=0, buckets=False, compact=False, date_index=None,
+                 summary_backend=None):
+        self._shards = shards
+        self._buckets = buckets
+        self._compact = compact
+        self._date_index = not compact if date_index is None else date_index
+        self._summary_backend = summary_backend
 
     def contribute_to_class(self, cls, name):
         self._name = name
@@ -79,6 +1011,8 @@ class VotesField(object):
                                                      verbose_name=_('down votes'))
             up_votes = models.PositiveIntegerField(default=0,
                                                    verbose_name=_('up votes'))
+            score = models.FloatField(default=0, db_index=True,
+                                      verbose_name=_('score'), editable=False)
             created_on = models.DateTimeField(auto_now_add=True, db_index=True,
                                               verbose_name=_('created on'),
                                               editable=False)
@@ -86,6 +1020,16 @@ class VotesField(object):
                                               verbose_name=_('updated on'),
                                               editable=False)
 
+            objects = SummaryManager('_vote_summary_cache')
+
+            counter_fields = ('up_votes', 'down_votes')
+            derived_fields = ('score',)
+            ranking_field = 'score'
+            shards = 0
+            shard_model = None
+            bucket_model = None
+            summary_backend = None
+
             @property
             def total_votes(self):
                 return self.up_votes + self.down_votes
@@ -109,10 +1053,61 @@ class VotesField(object):
                                                                     self.down_votes,
                                                                     self.up_votes)
 
+            def update_derived(self):
+                """
+                Recalculate the fields derived from the counters.
+                """
+                self.score = _wilson_lower_bound(self.up_votes, self.down_votes)
+
             @classmethod
             def get_model_name(self):
                 return '%s.%s' % (self._meta.app_label, self._meta.object_name)
 
+            @classmethod
+            def aggregate(cls, object_ids=None):
+                """
+                Count the up and down votes of many objects in the votes table
+                with one GROUP BY query. Yields (object_id, values) pairs
+                ordered by object.
+                """
+                votes = Vote.objects.filter(value__in=(1, -1))
+                if object_ids is not None:
+                    votes = votes.filter(object__in=object_ids)
+                rows = votes.values_list('object', 'value').annotate(Count('id')).order_by('object')
+
+                for object_id, group in groupby(rows.iterator(), itemgetter(0)):
+                    counts = dict((value, count) for _object_id, value, count in group)
+                    up_votes, down_votes = counts.get(1, 0), counts.get(-1, 0)
+                    yield object_id, {'up_votes': up_votes,
+                                      'down_votes': down_votes,
+                                      'score': _wilson_lower_bound(up_votes, down_votes)}
+
+            @classmethod
+            def compute(cls, object_id):
+                """
+                Count the up and down votes of an object in the votes table.
+                """
+                for _object_id, values in cls.aggregate([object_id]):
+                    return values
+                return {'up_votes': 0, 'down_votes': 0, 'score': 0}
+
+            @classmethod
+            def rebuild(cls, object_ids=None, batch_size=1000, dry_run=False):
+                """
+                Recompute the summaries of the given objects, or of all objects.
+                """
+                return _rebuild_summaries(cls, object_ids, batch_size, dry_run)
+
+            @classmethod
+            def add_votes(cls, object_id, up_votes=0, down_votes=0, create=True, deferred=None,
+                          shard_key=None):
+                """
+                Atomically add up and down votes to the summary of an object.
+                """
+                return cls.summary_backend.add(cls, object_id, {'up_votes': up_votes,
+                                                                'down_votes': down_votes},
+                                               create, deferred, shard_key)
+
         class VoteMeta(ModelBase):
             """
             Make every Vote model have their own name/table.
@@ -131,6 +1126,11 @@ class VotesField(object):
                 return vote_model
 
         rel_nm_user = '%s_votes' % model._meta.object_name.lower()
+        value_field = models.SmallIntegerField if self._compact else models.IntegerField
+        date_index = self._date_index
+        # The unique (object, voter) index also serves the lookups by object.
+        object_index = not self._compact
+        default_ordering = () if self._compact else ('date',)
 
         class Vote(models.Model):
             """
@@ -139,13 +1139,16 @@ class VotesField(object):
             __metaclass__ = VoteMeta
 
             voter = models.ForeignKey(User, verbose_name=_('voter'))
-            value = models.IntegerField(default=1, verbose_name=_('value'))
-            date = models.DateTimeField(auto_now_add=True, db_index=True,
+            value = value_field(default=1, verbose_name=_('value'))
+            date = models.DateTimeField(auto_now_add=True, db_index=date_index,
                                         verbose_name=_('voted on'))
-            object = models.ForeignKey(model, verbose_name=_('object'))
+            object = models.ForeignKey(model, db_index=object_index, verbose_name=_('object'))
+
+            objects = VoteManager()
 
             class Meta:
-                ordering = ('date',)
+                ordering = default_ordering
+                unique_together = (('object', 'voter'),)
                 verbose_name = '%s Vote' % model._meta.object_name
                 verbose_name_plural = '%s Votes' % model._meta.object_name
 
@@ -169,32 +1172,36 @@ class VotesField(object):
             def get_owner_model(self):
                 return model
 
+            @classmethod
+            def get_model_id(cls):
+                """
+                Short numeric id of this model, accepted by the views
+                instead of the model name.
+                """
+                return registry.model_id(cls)
+
+            @instrumented('vote.save')
             def save(self, *args, **kwargs):
                 """
                 Save vote, and update summary.
                 """
-                if self.id:
-                    last_value = Vote.objects.get(id=self.id).value
-                else:
-                    last_value = 0
-
-                # First update the summary
-                summary = self.object.vote_summary
-
-                if last_value == 1:
-                    summary.up_votes -= 1
-                if last_value == -1:
-                    summary.down_votes -= 1
+                with _atomic():
+                    last_value = _stored_value(Vote, self.id)
 
-                if self.value == 1:
-                    summary.up_votes += 1
-                if self.value == -1:
-                    summary.down_votes += 1
+                    # First save the vote, so that a summary created now
+                    # counts it.
+                    super(Vote, self).save(*args, **kwargs)
 
-                summary.save()
+                    # then update the summary
+                    deltas = _vote_deltas(last_value, self.value)
+                    VoteSummary.add_votes(self.object_id, shard_key=self.voter_id, **deltas)
+                    _update_buckets(VoteSummary, {(self.object_id, _hour(self.date)): deltas},
+                                    shard_key=self.voter_id)
 
-                # then save the vote
-                super(Vote, self).save(*args, **kwargs)
+                summary_cache.invalidate(VoteSummary, [self.object_id])
+                summary_cache.invalidate_user_votes(Vote, [(self.voter_id, self.object_id)])
+                if hasattr(self, Vote.object.cache_name):
+                    VoteSummary.objects.forget(self.object)
 
         class VoteFieldDescriptor(object):
             def __get__(self, obj, objtype):
@@ -206,6 +1213,13 @@ class VotesField(object):
                 else:
                     return Vote.objects
 
+        if self._shards:
+            VoteSummary.shards = self._shards
+            VoteSummary.shard_model = _create_counter_model(VoteSummary, 'Shard', _shard_keys())
+        VoteSummary.summary_backend = get_backend(self._summary_backend)
+        if self._buckets:
+            VoteSummary.bucket_model = _create_counter_model(VoteSummary, 'Bucket', _bucket_keys(self._shards))
+
         self._votes_model = Vote
         self._vote_summary_model = VoteSummary
         return VoteFieldDescriptor()
@@ -219,18 +1233,24 @@ class VotesField(object):
         VoteSummary = self._vote_summary_model
 
         def summary(self):
-            s, created = VoteSummary.objects.get_or_create(object=self)
+            if not hasattr(self, VoteSummary.objects.cache_name):
+                VoteSummary.objects.prefetch([self])
+            return getattr(self, VoteSummary.objects.cache_name)
 
-            if created:
-                s.down_votes = Vote.objects.filter(object=self, value= -1).count()
-                s.up_votes = Vote.objects.filter(object=self, value=1).count()
-                s.save()
-            return s
+        def with_vote_summaries(objects):
+            """
+            Load the vote summaries of a list of objects with one query.
+            """
+            return VoteSummary.objects.prefetch(objects)
 
         model.vote_summary = property(summary)
+        model.with_vote_summaries = staticmethod(with_vote_summaries)
         model.vote_model = Vote
         model.vote_summary_model = VoteSummary
 
+        # Connect a signal to handle delete of a Vote
+        signals.post_delete.connect(handle_vote_deleted, sender=Vote)
+
 
 class RatingsField(object):
     """
@@ -239,10 +1259,25 @@ class RatingsField(object):
     class MyModel(models.model):
         ...
         ratings = RatingsField()
+
+    To spread the writes of very popular objects over several rows, give the
+    number of counter shards per object: RatingsField(shards=8).
+
+    RatingsField(buckets=True) also keeps hourly rating totals, for
+    MyModel.ratings.trending().
+
+    RatingsField(compact=True) stores ratings in a smaller table, and
+    summary_backend picks the backend of the summary counters, see
+    VotesField.
     """
 
-    def __init__(self):
-        pass
+    def __init__(self, shards=0, buckets=False, compact=False, date_index=None,
+                 summary_backend=None):
+        self._shards = shards
+        self._buckets = buckets
+        self._compact = compact
+        self._date_index = not compact if date_index is None else date_index
+        self._summary_backend = summary_backend
 
     def contribute_to_class(self, cls, name):
         self._name = name
@@ -287,13 +1322,26 @@ class RatingsField(object):
             rating = models.FloatField(default=0,
                                        verbose_name=_('Rating'),
                                        null=False, blank=True)
+            bayesian_rating = models.FloatField(default=0, db_index=True,
+                                                verbose_name=_('Bayesian rating'),
+                                                editable=False)
             created_on = models.DateTimeField(auto_now_add=True, db_index=True,
                                               verbose_name=_('created on'),
                                               editable=False)
             updated_on = models.DateTimeField(auto_now=True, db_index=True,
                                               verbose_name=_('updated on'),
                                               editable=False)
-            
+
+            objects = SummaryManager('_rating_summary_cache')
+
+            counter_fields = ('rating_total', 'rating_count')
+            derived_fields = ('rating', 'bayesian_rating')
+            ranking_field = 'bayesian_rating'
+            shards = 0
+            shard_model = None
+            bucket_model = None
+            summary_backend = None
+
             class Meta:
                 ordering = ('object',)
                 verbose_name = '%s Rating Summary' % model._meta.object_name
@@ -304,9 +1352,62 @@ class RatingsField(object):
                                                                                           self.rating,
                                                                                           self.rating_count,)
 
+            def update_derived(self):
+                """
+                Recalculate the fields derived from the counters.
+                """
+                self.rating = _average(self.rating_total, self.rating_count)
+                self.bayesian_rating = _bayesian_average(self.rating_total, self.rating_count)
+
             @classmethod
             def get_model_name(cls):
-                return '%s.%s' % (self._meta.app_label, self._meta.object_name,)
+                return '%s.%s' % (cls._meta.app_label, cls._meta.object_name,)
+
+            @classmethod
+            def aggregate(cls, object_ids=None):
+                """
+                Sum the ratings of many objects in the ratings table with one
+                GROUP BY query. Yields (object_id, values) pairs ordered by
+                object.
+                """
+                ratings = Rating.objects.filter(value__gt=0)
+                if object_ids is not None:
+                    ratings = ratings.filter(object__in=object_ids)
+                rows = ratings.values_list('object').annotate(Sum('value'), Count('id')).order_by('object')
+
+                for object_id, total, rating_count in rows.iterator():
+                    yield object_id, {'rating_total': total,
+                                      'rating_count': rating_count,
+                                      'rating': _average(total, rating_count),
+                                      'bayesian_rating': _bayesian_average(total, rating_count)}
+
+            @classmethod
+            def compute(cls, object_id):
+                """
+                Sum the ratings of an object in the ratings table.
+                """
+                for _object_id, values in cls.aggregate([object_id]):
+                    return values
+                return {'rating_total': 0, 'rating_count': 0, 'rating': 0,
+                        'bayesian_rating': _bayesian_average(0, 0)}
+
+            @classmethod
+            def rebuild(cls, object_ids=None, batch_size=1000, dry_run=False):
+                """
+                Recompute the summaries of the given objects, or of all objects.
+                """
+                return _rebuild_summaries(cls, object_ids, batch_size, dry_run)
+
+            @classmethod
+            def add_ratings(cls, object_id, rating_total=0, rating_count=0, create=True, deferred=None,
+                            shard_key=None):
+                """
+                Atomically add to the rating total and count of an object, and
+                recalculate its average rating.
+                """
+                return cls.summary_backend.add(cls, object_id, {'rating_total': rating_total,
+                                                                'rating_count': rating_count},
+                                               create, deferred, shard_key)
 
         class RatingMeta(ModelBase):
             """
@@ -327,6 +1428,11 @@ class RatingsField(object):
                 return rating_model
 
         rel_nm_user = '%s_ratings' % model._meta.object_name.lower()
+        value_field = models.SmallIntegerField if self._compact else models.IntegerField
+        date_index = self._date_index
+        # The unique (object, voter) index also serves the lookups by object.
+        object_index = not self._compact
+        default_ordering = () if self._compact else ('date',)
 
         class Rating(models.Model):
             """
@@ -336,13 +1442,16 @@ class RatingsField(object):
             __metaclass__ = RatingMeta
 
             rater = models.ForeignKey(User, verbose_name=_('rater'))
-            value = models.IntegerField(default=0, verbose_name=_('value'))
-            date = models.DateTimeField(auto_now_add=True, db_index=True,
+            value = value_field(default=0, verbose_name=_('value'))
+            date = models.DateTimeField(auto_now_add=True, db_index=date_index,
                                         verbose_name=_('voted on'))
-            object = models.ForeignKey(model, verbose_name=_('object'))
+            object = models.ForeignKey(model, db_index=object_index, verbose_name=_('object'))
+
+            objects = RatingManager()
 
             class Meta:
-                ordering = ('date',)
+                ordering = default_ordering
+                unique_together = (('object', 'rater'),)
                 verbose_name = '%s Rating' % model._meta.object_name
                 verbose_name_plural = '%s Ratings' % model._meta.object_name
 
@@ -366,53 +1475,36 @@ class RatingsField(object):
             def get_owner_model(self):
                 return model
 
+            @classmethod
+            def get_model_id(cls):
+                """
+                Short numeric id of this model, accepted by the views
+                instead of the model name.
+                """
+                return registry.model_id(cls)
+
+            @instrumented('rating.save')
             def save(self, *args, **kwargs):
                 """
                 Save rating, and update summary.
                 """
-                
-                if self.id:
-                    last_value = Rating.objects.get(id=self.id).value
-                else:
-                    last_value = 0
-
-                # First update the summary
-                summary = self.object.rating_summary
-
-                if self.value == 0 and last_value > 0:
-                    # Canceling rating.
-                    
-                    # subtract old value
-                    summary.rating_total -= last_value
-                    # decrease count by 1
-                    summary.rating_count -= 1
-                elif self.value > 0 and last_value > 0:
-                    # Editing rating.
-                    
-                    # subtract old value
-                    summary.rating_total -= last_value
-                    # add new value
-                    summary.rating_total += self.value
-                elif self.value == 0 and last_value == 0:
-                    # Initiating rating record. don't do anything                    
-                    pass                    
-                elif self.value > 0 and last_value == 0:
-                    # New rating
-                    
-                    # add new value
-                    summary.rating_total += self.value
-                    # increase count by 1
-                    summary.rating_count += 1
-
-                if summary.rating_count > 0:    
-                    summary.rating = round(float(summary.rating_total) / float(summary.rating_count), 1)
-                else:
-                    summary.rating = 0
-                    
-                summary.save()
+                with _atomic():
+                    last_value = _stored_value(Rating, self.id)
 
-                # then save the vote
-                super(Rating, self).save(*args, **kwargs)
+                    # First save the rating, so that a summary created now
+                    # counts it.
+                    super(Rating, self).save(*args, **kwargs)
+
+                    # then update the summary
+                    deltas = _rating_deltas(last_value, self.value)
+                    RatingSummary.add_ratings(self.object_id, shard_key=self.rater_id, **deltas)
+                    _update_buckets(RatingSummary, {(self.object_id, _hour(self.date)): deltas},
+                                    shard_key=self.rater_id)
+
+                summary_cache.invalidate(RatingSummary, [self.object_id])
+                summary_cache.invalidate_user_votes(Rating, [(self.rater_id, self.object_id)])
+                if hasattr(self, Rating.object.cache_name):
+                    RatingSummary.objects.forget(self.object)
 
         class RatingFieldDescriptor(object):
             def __get__(self, obj, objtype):
@@ -424,6 +1516,13 @@ class RatingsField(object):
                 else:
                     return Rating.objects
 
+        if self._shards:
+            RatingSummary.shards = self._shards
+            RatingSummary.shard_model = _create_counter_model(RatingSummary, 'Shard', _shard_keys())
+        RatingSummary.summary_backend = get_backend(self._summary_backend)
+        if self._buckets:
+            RatingSummary.bucket_model = _create_counter_model(RatingSummary, 'Bucket', _bucket_keys(self._shards))
+
         self._ratings_model = Rating
         self._rating_summary_model = RatingSummary
 
@@ -439,18 +1538,18 @@ class RatingsField(object):
         RatingSummary = self._rating_summary_model
 
         def summary(self):
-            s, created = RatingSummary.objects.get_or_create(object=self)
+            if not hasattr(self, RatingSummary.objects.cache_name):
+                RatingSummary.objects.prefetch([self])
+            return getattr(self, RatingSummary.objects.cache_name)
 
-            if created:
-                count = Rating.objects.filter(object=self).count()
-                sum = Rating.objects.filter(object=self).aggregate(sum=Sum('value'))
-                s.rating_total = sum['sum'] if sum['sum'] else 0
-                s.rating_count = count
-                s.save()
-
-            return s
+        def with_rating_summaries(objects):
+            """
+            Load the rating summaries of a list of objects with one query.
+            """
+            return RatingSummary.objects.prefetch(objects)
 
         model.rating_summary = property(summary)
+        model.with_rating_summaries = staticmethod(with_rating_summaries)
         model.rating_model = Rating
         model.rating_summary_model = RatingSummary
 
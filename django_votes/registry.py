@@ -0,0 +1,116 @@
+"""
+Registry of the generated vote and rating models, and of their summary
+models.
+
+Models are looked up by name ("app.MyModelVote") or by a short numeric id,
+which is the id of their content type: it is the same for every process
+sharing the database. The names are collected the first time the registry
+is used, once all models are loaded; the ids are read from the content
+types table the first time one is needed.
+"""
+import threading
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.loading import get_models
+
+VOTE = 'vote'
+RATING = 'rating'
+VOTE_SUMMARY = 'vote_summary'
+RATING_SUMMARY = 'rating_summary'
+
+
+class UnknownModel(Exception):
+    pass
+
+
+class Registry(object):
+    def __init__(self):
+        self._by_name = None
+        self._kinds = None
+        self._by_id = None
+        self._ids = None
+        self._lock = threading.Lock()
+
+    def _names(self):
+        """
+        name -> (kind, model)
+        """
+        if self._by_name is None:
+            with self._lock:
+                if self._by_name is None:
+                    # Loading all models runs the metaclasses which create
+                    # the vote and rating models.
+                    get_models()
+                    from django_votes.models import _vote_models, _rating_models
+
+                    by_name = {}
+                    for kind, summary_kind, models in ((VOTE, VOTE_SUMMARY, _vote_models),
+                                                       (RATING, RATING_SUMMARY, _rating_models)):
+                        for name, model in models.items():
+                            summary_model = model.get_summary_model()
+                            by_name[name] = (kind, model)
+                            by_name[summary_model.get_model_name()] = (summary_kind, summary_model)
+                    self._kinds = dict((model, kind) for kind, model in by_name.values())
+                    self._by_name = by_name
+        return self._by_name
+
+    def _numeric_ids(self):
+        """
+        id -> (kind, model)
+        """
+        if self._by_id is None:
+            entries = self._names().values()
+            content_types = ContentType.objects.get_for_models(*[model for kind, model in entries])
+            with self._lock:
+                self._ids = dict((model, content_types[model].pk) for kind, model in entries)
+                self._by_id = dict((content_types[model].pk, (kind, model)) for kind, model in entries)
+        return self._by_id
+
+    def get(self, key, kinds=(VOTE, RATING, VOTE_SUMMARY, RATING_SUMMARY)):
+        """
+        The model with the given name or numeric id, which must be of one of
+        the given kinds. Raises UnknownModel otherwise.
+        """
+        if isinstance(key, (int, long)) or (isinstance(key, basestring) and key.isdigit()):
+            entry = self._numeric_ids().get(int(key))
+        else:
+            entry = self._names().get(key)
+
+        if entry is None or entry[0] not in kinds:
+            raise UnknownModel('No such %s model "%s"' % (' or '.join(kinds).replace('_', ' '), key))
+        return entry[1]
+
+    def vote_model(self, key):
+        return self.get(key, (VOTE,))
+
+    def rating_model(self, key):
+        return self.get(key, (RATING,))
+
+    def vote_or_rating_model(self, key):
+        return self.get(key, (VOTE, RATING))
+
+    def summary_model(self, key):
+        return self.get(key, (VOTE_SUMMARY, RATING_SUMMARY))
+
+    def models(self, kinds=(VOTE, RATING)):
+        """
+        The models of the given kinds, as a dict name -> model.
+        """
+        return dict((name, model) for name, (kind, model) in self._names().items() if kind in kinds)
+
+    def kind(self, model):
+        """
+        The kind of a registered model: VOTE, RATING, VOTE_SUMMARY or
+        RATING_SUMMARY.
+        """
+        self._names()
+        return self._kinds[model]
+
+    def model_id(self, model):
+        """
+        The numeric id of a registered model.
+        """
+        self._numeric_ids()
+        return self._ids[model]
+
+registry = Registry()
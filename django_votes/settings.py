@@ -0,0 +1,71 @@
+from django.conf import settings
+
+# Alias of the cache (see settings.CACHES) in which vote and rating summaries
+# are kept. Summaries are not cached when this is None.
+SUMMARY_CACHE = getattr(settings, 'VOTES_SUMMARY_CACHE', None)
+
+# Number of seconds a summary stays in the cache.
+SUMMARY_CACHE_TIMEOUT = getattr(settings, 'VOTES_SUMMARY_CACHE_TIMEOUT', 300)
+
+# Dotted path of the backend keeping the summary counters, see
+# django_votes.backends. VotesField(summary_backend=...) overrides it.
+SUMMARY_BACKEND = getattr(settings, 'VOTES_SUMMARY_BACKEND', 'django_votes.backends.DatabaseBackend')
+
+# Alias of the cache holding the counters of the CacheCounterBackend.
+SUMMARY_COUNTER_CACHE = getattr(settings, 'VOTES_SUMMARY_COUNTER_CACHE', 'default')
+
+# Number of seconds the counters of the CacheCounterBackend stay in the cache
+# after their last change. They must be flushed before.
+SUMMARY_COUNTER_TIMEOUT = getattr(settings, 'VOTES_SUMMARY_COUNTER_TIMEOUT', 60 * 60 * 24 * 30)
+
+# When True, saving a vote only logs the change of its summary in the
+# SummaryDelta table. The fold_vote_summaries command applies the logged
+# changes to the summaries in batches.
+DEFERRED_SUMMARIES = getattr(settings, 'VOTES_DEFERRED_SUMMARIES', False)
+
+# Number of seconds fold_vote_summaries waits between two batches, which
+# bounds how far the summaries lag behind the votes in deferred mode.
+DEFERRED_INTERVAL = getattr(settings, 'VOTES_DEFERRED_INTERVAL', 5)
+
+# z value of the Wilson score interval behind VoteSummary.score (1.96 for
+# 95% confidence).
+WILSON_Z = getattr(settings, 'VOTES_WILSON_Z', 1.96)
+
+# Prior of RatingSummary.bayesian_rating: every object counts as if it also
+# had RATING_PRIOR_WEIGHT ratings of RATING_PRIOR_MEAN.
+RATING_PRIOR_MEAN = getattr(settings, 'VOTES_RATING_PRIOR_MEAN', 3.0)
+RATING_PRIOR_WEIGHT = getattr(settings, 'VOTES_RATING_PRIOR_WEIGHT', 5)
+
+# Highest rating accepted by the rating and batch views, which take ratings
+# from 1 to RATING_MAX.
+RATING_MAX = getattr(settings, 'VOTES_RATING_MAX', 5)
+
+# Maximum number of object ids of one request to the summaries view.
+SUMMARIES_MAX_IDS = getattr(settings, 'VOTES_SUMMARIES_MAX_IDS', 100)
+
+# Number of seconds after which a leaderboard is reloaded from the database,
+# to pick up the votes handled by other processes. None never reloads.
+LEADERBOARD_TTL = getattr(settings, 'VOTES_LEADERBOARD_TTL', 300)
+
+# Measure the duration and number of queries of the voting operations, see
+# django_votes.instrumentation. Read once, at startup.
+INSTRUMENTATION = getattr(settings, 'VOTES_INSTRUMENTATION', False)
+
+# Alias of the cache in which the votes of users are kept, for
+# VoteManager.user_votes. The votes are not cached when this is None.
+USER_VOTES_CACHE = getattr(settings, 'VOTES_USER_VOTES_CACHE', None)
+
+# Number of seconds the vote of a user stays in the cache.
+USER_VOTES_CACHE_TIMEOUT = getattr(settings, 'VOTES_USER_VOTES_CACHE_TIMEOUT', 3600)
+
+# Alias of the cache holding the throttling state of the voting views, see
+# django_votes.throttling. The views are not throttled when this is None.
+THROTTLE_CACHE = getattr(settings, 'VOTES_THROTTLE_CACHE', None)
+
+# Token buckets per vote model name (or 'default'): {'user': (votes,
+# seconds), 'ip': (votes, seconds)}.
+THROTTLE_RATES = getattr(settings, 'VOTES_THROTTLE_RATES', {})
+
+# Number of seconds during which repeating the last vote on an object is
+# skipped.
+THROTTLE_REPEAT_TIMEOUT = getattr(settings, 'VOTES_THROTTLE_REPEAT_TIMEOUT', 10)
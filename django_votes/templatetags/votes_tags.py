@@ -0,0 +1,48 @@
+"""
+Template tags showing the votes of the current user on a list of objects,
+with one query for the whole list:
+
+    {% load votes_tags %}
+    {% user_votes object_list as my_votes %}
+    {% for object in object_list %}
+        {% with my_votes|vote_for:object as vote %}
+            {% if vote == 1 %}You like this{% endif %}
+        {% endwith %}
+    {% endfor %}
+
+user_ratings does the same for ratings.
+"""
+from django import template
+
+register = template.Library()
+
+
+def _user_votes(context, objects, vote_model_attr):
+    objects = list(objects)
+    user = context.get('user')
+    if not objects or user is None or not user.is_authenticated():
+        return {}
+    vote_model = getattr(objects[0], vote_model_attr)
+    return vote_model.objects.user_votes(user, [obj.pk for obj in objects])
+
+@register.assignment_tag(takes_context=True)
+def user_votes(context, objects):
+    """
+    The votes of the current user on the objects, as object_id -> value.
+    """
+    return _user_votes(context, objects, 'vote_model')
+
+@register.assignment_tag(takes_context=True)
+def user_ratings(context, objects):
+    """
+    The ratings of the current user on the objects, as object_id -> value.
+    """
+    return _user_votes(context, objects, 'rating_model')
+
+@register.filter
+def vote_for(votes, obj):
+    """
+    The vote on an object (or object id) in the result of user_votes or
+    user_ratings, 0 when there is none.
+    """
+    return votes.get(getattr(obj, 'pk', obj), 0)
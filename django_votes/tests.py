@@ -0,0 +1,558 @@
+import json
+import os
+import tempfile
+import time
+from datetime import timedelta
+from StringIO import StringIO
+
+from django.contrib.auth.models import User
+from django.core.cache import get_cache
+from django.core.management import call_command
+from django.core.urlresolvers import reverse
+from django.db import connections, models, transaction
+from django.test import TestCase, TransactionTestCase
+from django.utils.http import parse_http_date
+
+from django_votes import leaderboard as leaderboards
+from django_votes import settings as votes_settings
+from django_votes.registry import registry
+from django_votes.models import VotesField, RatingsField, SummaryDelta
+from django_votes.utils import bulk_insert
+
+
+class Article(models.Model):
+    """
+    The object voted on by the tests.
+    """
+    title = models.CharField(max_length=100)
+
+    votes = VotesField(buckets=True)
+    ratings = RatingsField()
+
+
+class ShardedArticle(models.Model):
+    """
+    An object whose summaries are spread over shards.
+    """
+    title = models.CharField(max_length=100)
+
+    votes = VotesField(shards=4, buckets=True)
+    ratings = RatingsField(shards=4)
+
+
+class CountedArticle(models.Model):
+    """
+    An object whose vote counters are kept in the cache.
+    """
+    title = models.CharField(max_length=100)
+
+    votes = VotesField(summary_backend='django_votes.backends.CacheCounterBackend')
+
+
+class VotesTestCase(TestCase):
+    def setUp(self):
+        get_cache('default').clear()
+        self.users = [User.objects.create(username='user%d' % i) for i in range(3)]
+        self.articles = [Article.objects.create(title='article%d' % i) for i in range(3)]
+
+    def tearDown(self):
+        get_cache('default').clear()
+
+    def assertSummariesMatchVotes(self, summary_model, object_ids):
+        """
+        The summaries read through the summary backend have the counts of
+        the votes table.
+        """
+        summaries = summary_model.objects.get_many(object_ids)
+        for object_id in object_ids:
+            computed = summary_model.compute(object_id)
+            for field in summary_model.counter_fields:
+                self.assertEqual(getattr(summaries[object_id], field), computed[field])
+
+
+class SummaryCacheTest(VotesTestCase):
+    def setUp(self):
+        super(SummaryCacheTest, self).setUp()
+        self.old_cache = votes_settings.SUMMARY_CACHE
+        votes_settings.SUMMARY_CACHE = 'default'
+        for user in self.users:
+            for article in self.articles:
+                Article.votes.cast(user, article.pk, 1)
+
+    def tearDown(self):
+        votes_settings.SUMMARY_CACHE = self.old_cache
+        super(SummaryCacheTest, self).tearDown()
+
+    def test_cached_read_takes_no_query(self):
+        object_ids = [article.pk for article in self.articles]
+        Article.vote_summary_model.objects.get_many(object_ids)
+        with self.assertNumQueries(0):
+            summaries = Article.vote_summary_model.objects.get_many(object_ids)
+        self.assertEqual([summaries[object_id].up_votes for object_id in object_ids], [3, 3, 3])
+
+    def test_vote_invalidates_the_cached_summary(self):
+        article = self.articles[0]
+        Article.vote_summary_model.objects.get_many([article.pk])
+        Article.votes.cast(self.users[0], article.pk, -1)
+        summary = Article.vote_summary_model.objects.get_many([article.pk])[article.pk]
+        self.assertEqual((summary.up_votes, summary.down_votes), (2, 1))
+
+
+class DerivedFieldsTest(VotesTestCase):
+    def test_summaries_without_ratings(self):
+        unrated, retracted = self.articles[:2]
+        Article.ratings.cast(self.users[0], retracted.pk, 1)
+        Article.ratings.retract(self.users[0], retracted.pk)
+
+        summary_model = Article.rating_summary_model
+        self.assertEqual(unrated.rating_summary.bayesian_rating, votes_settings.RATING_PRIOR_MEAN)
+        for article in (unrated, retracted):
+            self.assertEqual(summary_model.objects.get(object=article).bayesian_rating,
+                             votes_settings.RATING_PRIOR_MEAN)
+
+
+class DeferredSummariesTest(VotesTestCase):
+    def setUp(self):
+        super(DeferredSummariesTest, self).setUp()
+        self.old_deferred = votes_settings.DEFERRED_SUMMARIES
+        votes_settings.DEFERRED_SUMMARIES = True
+
+    def tearDown(self):
+        votes_settings.DEFERRED_SUMMARIES = self.old_deferred
+        super(DeferredSummariesTest, self).tearDown()
+
+    def test_deletes_are_logged_after_the_votes(self):
+        article = self.articles[0]
+        summary_model = Article.vote_summary_model
+        Article.votes.cast(self.users[0], article.pk, 1)
+        summary_model.objects.get_many([article.pk])
+
+        Article.votes.cast(self.users[1], article.pk, 1)
+        Article.votes.retract(self.users[1], article.pk)
+        Article.votes.cast(self.users[2], article.pk, -1)
+        Article.votes.get(voter=self.users[2]).delete()
+        summary = summary_model.objects.get(object=article)
+        self.assertEqual((summary.up_votes, summary.down_votes), (1, 0))
+
+        SummaryDelta.objects.fold()
+        self.assertEqual(SummaryDelta.objects.count(), 0)
+        self.assertSummariesMatchVotes(summary_model, [article.pk])
+
+    def test_bucket_changes_are_logged(self):
+        article = self.articles[0]
+        bucket_model = Article.vote_summary_model.bucket_model
+        for user in self.users:
+            Article.votes.cast(user, article.pk, 1)
+        self.assertEqual(bucket_model.objects.count(), 0)
+
+        SummaryDelta.objects.fold()
+        Article.votes.get(voter=self.users[0]).delete()
+        self.assertEqual(Article.votes.trending(), [(article.pk, {'up_votes': 3, 'down_votes': 0})])
+        SummaryDelta.objects.fold()
+        self.assertEqual(Article.votes.trending(), [(article.pk, {'up_votes': 2, 'down_votes': 0})])
+
+
+class ShardsTest(VotesTestCase):
+    def setUp(self):
+        super(ShardsTest, self).setUp()
+        self.users += [User.objects.create(username='user%d' % i) for i in range(3, 5)]
+        self.article = ShardedArticle.objects.create(title='sharded')
+        for user in self.users:
+            ShardedArticle.votes.cast(user, self.article.pk, 1)
+            ShardedArticle.ratings.cast(user, self.article.pk, 5)
+
+    def test_fold_recomputes_the_stored_scores(self):
+        vote_summary_model = ShardedArticle.vote_summary_model
+        rating_summary_model = ShardedArticle.rating_summary_model
+        self.assertEqual(vote_summary_model.objects.get(object=self.article).up_votes, 1)
+
+        call_command('fold_vote_summaries', stdout=StringIO())
+        self.assertEqual(vote_summary_model.shard_model.objects.count(), 0)
+        self.assertEqual(rating_summary_model.shard_model.objects.count(), 0)
+        for summary_model in (vote_summary_model, rating_summary_model):
+            stored = summary_model.objects.get(object=self.article)
+            computed = summary_model(**summary_model.compute(self.article.pk))
+            computed.update_derived()
+            for field in summary_model.counter_fields + summary_model.derived_fields:
+                self.assertAlmostEqual(getattr(stored, field), getattr(computed, field))
+        self.assertAlmostEqual(vote_summary_model.objects.get(object=self.article).score, 0.5655, 4)
+
+    def test_sharded_buckets(self):
+        bucket_model = ShardedArticle.vote_summary_model.bucket_model
+        self.assertEqual(bucket_model.objects.count(), 4)
+        ShardedArticle.votes.get(voter=self.users[0]).delete()
+        ShardedArticle.votes.bulk_delete(ShardedArticle.votes.filter(voter=self.users[1]))
+        self.assertEqual(ShardedArticle.votes.trending(), [(self.article.pk, {'up_votes': 3, 'down_votes': 0})])
+
+        ShardedArticle.votes.rebuild_buckets()
+        ShardedArticle.votes.get(voter=self.users[2]).delete()
+        self.assertEqual(ShardedArticle.votes.trending(), [(self.article.pk, {'up_votes': 2, 'down_votes': 0})])
+
+    def test_leaderboard_counts_the_shards(self):
+        summary_model = ShardedArticle.vote_summary_model
+        board = ShardedArticle.votes.leaderboard()
+        self.addCleanup(leaderboards.reset, summary_model)
+
+        def assertScore():
+            computed = summary_model(**summary_model.compute(self.article.pk))
+            computed.update_derived()
+            self.assertEqual(board.top(1), [(self.article.pk, computed.score)])
+
+        assertScore()
+        ShardedArticle.votes.cast(User.objects.create(username='down'), self.article.pk, -1)
+        assertScore()
+        summary_model.objects.fold_shards()
+        assertScore()
+        board.load()
+        assertScore()
+
+
+class BulkInsertTest(VotesTestCase):
+    """
+    More rows than SQLite takes in one INSERT.
+    """
+    def setUp(self):
+        super(BulkInsertTest, self).setUp()
+        bulk_insert(Article, [Article(title='bulk%d' % i) for i in range(800)])
+        self.object_ids = list(Article.objects.filter(title__startswith='bulk').values_list('pk', flat=True))
+
+    def test_bulk_cast_and_rebuild(self):
+        Article.votes.bulk_cast((self.users[0].pk, object_id, 1) for object_id in self.object_ids)
+        self.assertEqual(Article.vote_summary_model.rebuild(), 800)
+        self.assertSummariesMatchVotes(Article.vote_summary_model, self.object_ids[:100])
+
+    def test_with_summaries(self):
+        articles = Article.with_vote_summaries(Article.objects.filter(pk__in=self.object_ids))
+        self.assertEqual(len(articles), 800)
+        self.assertEqual(Article.vote_summary_model.objects.count(), 800)
+
+    def test_nothing_to_insert(self):
+        # The batches aren't capped on the other databases.
+        connection = connections[Article.objects.db]
+        connection.vendor = 'postgresql'
+        try:
+            bulk_insert(Article, [])
+            article_id = self.articles[0].pk
+            Article.votes.bulk_cast([(self.users[0].pk, article_id, 1)])
+            Article.votes.bulk_cast([(self.users[0].pk, article_id, -1)])
+        finally:
+            del connection.vendor
+        self.assertEqual(Article.votes.get(voter=self.users[0]).value, -1)
+        self.assertSummariesMatchVotes(Article.vote_summary_model, [article_id])
+
+
+class CacheCounterBackendTest(VotesTestCase):
+    """
+    The counters in the local memory cache, and their flush to the summary
+    table.
+    """
+    def setUp(self):
+        super(CacheCounterBackendTest, self).setUp()
+        self.old_cache = votes_settings.SUMMARY_COUNTER_CACHE
+        votes_settings.SUMMARY_COUNTER_CACHE = 'default'
+        self.article = CountedArticle.objects.create(title='counted')
+        self.summary_model = CountedArticle.vote_summary_model
+
+    def tearDown(self):
+        votes_settings.SUMMARY_COUNTER_CACHE = self.old_cache
+        super(CacheCounterBackendTest, self).tearDown()
+
+    def stored(self):
+        summary = self.summary_model.objects.get(object=self.article)
+        return summary.up_votes, summary.down_votes
+
+    def test_votes_are_counted_in_the_cache(self):
+        CountedArticle.votes.cast(self.users[0], self.article.pk, 1)
+        CountedArticle.votes.cast(self.users[1], self.article.pk, 1)
+        CountedArticle.votes.cast(self.users[2], self.article.pk, -1)
+        CountedArticle.votes.get(voter=self.users[1]).delete()
+        # Not written to the summary table before the flush.
+        self.assertFalse(self.summary_model.objects.filter(object=self.article).exists())
+
+        with self.assertNumQueries(0):
+            summary = self.summary_model.objects.get_many([self.article.pk])[self.article.pk]
+        self.assertEqual((summary.up_votes, summary.down_votes), (1, 1))
+        self.assertSummariesMatchVotes(self.summary_model, [self.article.pk])
+
+    def test_flush_writes_the_counters(self):
+        for user in self.users:
+            CountedArticle.votes.cast(user, self.article.pk, 1)
+        CountedArticle.votes.retract(self.users[0], self.article.pk)
+        call_command('flush_vote_counters', stdout=StringIO())
+        self.assertEqual(self.stored(), (2, 0))
+        self.assertAlmostEqual(self.summary_model.objects.get(object=self.article).score,
+                               self.summary_model.objects.get_many([self.article.pk])[self.article.pk].score)
+
+        # Nothing left to flush, until the next vote.
+        self.assertEqual(self.summary_model.summary_backend.flush(self.summary_model), 0)
+        CountedArticle.votes.cast(self.users[0], self.article.pk, -1)
+        self.assertEqual(self.summary_model.summary_backend.flush(self.summary_model), 1)
+        self.assertEqual(self.stored(), (2, 1))
+
+
+    def test_flush_after_the_log_was_lost(self):
+        backend = self.summary_model.summary_backend
+        cache = get_cache(votes_settings.SUMMARY_COUNTER_CACHE)
+        for user in self.users:
+            CountedArticle.votes.cast(user, self.article.pk, 1)
+        backend.flush(self.summary_model)
+
+        # Evicted, or expired.
+        cache.delete(backend._log_key(self.summary_model))
+        CountedArticle.votes.cast(User.objects.create(username='evicted'), self.article.pk, 1)
+        self.assertEqual(backend.flush(self.summary_model), 1)
+        self.assertEqual(self.stored(), (4, 0))
+
+        # Restarted behind the last flush.
+        cache.set(backend._log_key(self.summary_model), 0)
+        CountedArticle.votes.cast(User.objects.create(username='restarted'), self.article.pk, -1)
+        self.assertEqual(backend.flush(self.summary_model), 1)
+        self.assertEqual(self.stored(), (4, 1))
+
+
+class ThrottlingTest(VotesTestCase):
+    urls = 'django_votes.urls'
+
+    def setUp(self):
+        super(ThrottlingTest, self).setUp()
+        self.old_settings = votes_settings.THROTTLE_CACHE, votes_settings.THROTTLE_RATES
+        votes_settings.THROTTLE_CACHE = 'default'
+        votes_settings.THROTTLE_RATES = {Article.vote_model.get_model_name(): {'user': (2, 60)}}
+        User.objects.create_user('throttled', 'throttled@example.com', 'secret')
+        self.client.login(username='throttled', password='secret')
+
+    def tearDown(self):
+        votes_settings.THROTTLE_CACHE, votes_settings.THROTTLE_RATES = self.old_settings
+        super(ThrottlingTest, self).tearDown()
+
+    def vote(self, model):
+        return [self.client.post(reverse('votes_vote_up'), {'model': model, 'object_id': article.pk}).status_code
+                for article in self.articles]
+
+    def test_model_name(self):
+        self.assertEqual(self.vote(Article.vote_model.get_model_name()), [302, 302, 429])
+
+    def test_numeric_id_shares_the_limits(self):
+        self.assertEqual(self.vote(registry.model_id(Article.vote_model)), [302, 302, 429])
+
+    def batch(self, articles):
+        return self.client.post(reverse('votes_batch'), json.dumps([
+            {'model': Article.vote_model.get_model_name(), 'object_id': article.pk, 'value': 1}
+            for article in articles]), content_type='application/json').status_code
+
+    def test_batch_takes_a_token_per_action(self):
+        self.assertEqual(self.batch(self.articles), 429)
+        self.assertEqual(Article.vote_model.objects.count(), 0)
+        self.assertEqual(self.vote(Article.vote_model.get_model_name()), [429, 429, 429])
+
+    def test_batch_within_the_limits(self):
+        self.assertEqual(self.batch(self.articles[:2]), 200)
+        self.assertEqual(Article.vote_model.objects.count(), 2)
+
+    def up_vote(self, article):
+        return self.client.post(reverse('votes_vote_up'), {'model': Article.vote_model.get_model_name(),
+                                                           'object_id': article.pk})
+
+    def test_repeated_vote_gets_the_same_answer(self):
+        votes_settings.THROTTLE_RATES = {}
+        article = self.articles[0]
+        first, repeated = self.up_vote(article), self.up_vote(article)
+        self.assertEqual((repeated.status_code, repeated['Location']), (first.status_code, first['Location']))
+        self.assertEqual(first.status_code, 302)
+
+    def test_vote_after_a_batch_isnt_a_repeat(self):
+        votes_settings.THROTTLE_RATES = {}
+        article = self.articles[0]
+        self.up_vote(article)
+        self.client.post(reverse('votes_batch'), json.dumps([
+            {'model': Article.vote_model.get_model_name(), 'object_id': article.pk, 'value': -1}]),
+            content_type='application/json')
+        self.assertEqual(Article.votes.get().value, -1)
+        self.up_vote(article)
+        self.assertEqual(Article.votes.get().value, 1)
+
+
+class BatchVoteTest(VotesTestCase):
+    urls = 'django_votes.urls'
+
+    def setUp(self):
+        super(BatchVoteTest, self).setUp()
+        User.objects.create_user('batch', 'batch@example.com', 'secret')
+        self.client.login(username='batch', password='secret')
+
+    def batch(self, *actions):
+        return self.client.post(reverse('votes_batch'), json.dumps([
+            {'model': model.get_model_name(), 'object_id': object_id, 'value': value}
+            for model, object_id, value in actions]), content_type='application/json')
+
+    def test_valid_batch(self):
+        article = self.articles[0]
+        response = self.batch((Article.vote_model, article.pk, -1), (Article.rating_model, article.pk, 5))
+        self.assertEqual(response.status_code, 200)
+        results = dict((result['model'], result) for result in json.loads(response.content))
+        self.assertEqual(results[Article.vote_model.get_model_name()]['down_votes'], 1)
+        self.assertEqual(results[Article.rating_model.get_model_name()]['rating_total'], 5)
+
+    def test_invalid_actions_apply_nothing(self):
+        article = self.articles[0]
+        for invalid in ((Article.vote_model, article.pk, 2),
+                        (Article.vote_model, article.pk, 0),
+                        (Article.rating_model, article.pk, 0),
+                        (Article.rating_model, article.pk, votes_settings.RATING_MAX + 1),
+                        (Article.vote_model, max(a.pk for a in self.articles) + 1, 1)):
+            response = self.batch((Article.vote_model, article.pk, 1), invalid)
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(Article.vote_model.objects.count(), 0)
+        self.assertEqual(Article.rating_model.objects.count(), 0)
+
+
+class SummariesViewTest(VotesTestCase):
+    urls = 'django_votes.urls'
+
+    def setUp(self):
+        super(SummariesViewTest, self).setUp()
+        self.article = self.articles[0]
+        Article.votes.cast(self.users[0], self.article.pk, 1)
+
+    def get(self, model, object_ids, **headers):
+        return self.client.get(reverse('votes_summaries', args=[model.get_model_name()]),
+                               {'ids': ','.join(str(object_id) for object_id in object_ids)}, **headers)
+
+    def test_etag(self):
+        response = self.get(Article.vote_model, [self.article.pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(Article.vote_model, [self.article.pk],
+                                  HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+
+        Article.votes.cast(self.users[1], self.article.pk, 1)
+        self.assertEqual(self.get(Article.vote_model, [self.article.pk],
+                                  HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_last_modified(self):
+        response = self.get(Article.vote_model, [self.article.pk])
+        self.assertTrue(abs(parse_http_date(response['Last-Modified']) - time.time()) < 60)
+
+        # One second resolution: the row is made older than the header.
+        summary_model = Article.vote_summary_model
+        summary_model.objects.update(updated_on=summary_model.objects.get().updated_on - timedelta(seconds=5))
+        response = self.get(Article.vote_model, [self.article.pk])
+        self.assertEqual(self.get(Article.vote_model, [self.article.pk],
+                                  HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        Article.votes.cast(self.users[1], self.article.pk, 1)
+        self.assertEqual(self.get(Article.vote_model, [self.article.pk],
+                                  HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 200)
+
+    def test_no_last_modified_for_shards(self):
+        article = ShardedArticle.objects.create(title='sharded')
+        ShardedArticle.votes.cast(self.users[0], article.pk, 1)
+        ShardedArticle.votes.cast(self.users[1], article.pk, 1)
+        response = self.get(ShardedArticle.vote_model, [article.pk])
+        self.assertEqual(json.loads(response.content)[0]['up_votes'], 2)
+        self.assertFalse(response.has_header('Last-Modified'))
+
+    def test_too_many_ids(self):
+        object_ids = range(1, votes_settings.SUMMARIES_MAX_IDS + 2)
+        self.assertEqual(self.get(Article.vote_model, object_ids[:-1]).status_code, 200)
+        self.assertEqual(self.get(Article.vote_model, object_ids).status_code, 400)
+
+
+class RatingViewTest(VotesTestCase):
+    urls = 'django_votes.urls'
+
+    def setUp(self):
+        super(RatingViewTest, self).setUp()
+        User.objects.create_user('rater', 'rater@example.com', 'secret')
+        self.client.login(username='rater', password='secret')
+
+    def rate(self, rating):
+        return self.client.post(reverse('votes_rating'), {'model': Article.rating_model.get_model_name(),
+                                                          'object_id': self.articles[0].pk,
+                                                          'rating': rating}).status_code
+
+    def test_ratings_out_of_range(self):
+        for rating in (0, -1, votes_settings.RATING_MAX + 1, 1000):
+            self.assertEqual(self.rate(rating), 400)
+        self.assertEqual(Article.rating_model.objects.count(), 0)
+        self.assertEqual(self.rate(votes_settings.RATING_MAX), 302)
+        self.assertEqual(Article.rating_model.objects.get().value, votes_settings.RATING_MAX)
+
+
+class TransactionTest(TransactionTestCase):
+    """
+    Voting inside a transaction of the caller doesn't commit or roll back
+    that transaction.
+    """
+    def setUp(self):
+        self.user = User.objects.create(username='voter')
+
+    def test_rolled_back_with_the_caller(self):
+        try:
+            with transaction.commit_on_success():
+                article = Article.objects.create(title='article')
+                Article.votes.cast(self.user, article.pk, 1)
+                Article.ratings.cast(self.user, article.pk, 4)
+                raise ValueError
+        except ValueError:
+            pass
+        self.assertEqual(Article.objects.count(), 0)
+        self.assertEqual(Article.vote_model.objects.count(), 0)
+        self.assertEqual(Article.rating_model.objects.count(), 0)
+
+    def test_repeated_vote_keeps_the_caller_changes(self):
+        article = Article.objects.create(title='article')
+        Article.votes.cast(self.user, article.pk, 1)
+        with transaction.commit_on_success():
+            Article.objects.create(title='created before the vote')
+            Article.votes.cast(self.user, article.pk, -1)
+        self.assertEqual(Article.objects.filter(title='created before the vote').count(), 1)
+        summary = Article.vote_summary_model.objects.get_many([article.pk])[article.pk]
+        self.assertEqual((summary.up_votes, summary.down_votes), (0, 1))
+
+    def test_summary_read_doesnt_commit(self):
+        with transaction.commit_manually():
+            article = Article.objects.create(title='article')
+            article.vote_summary
+            transaction.rollback()
+        self.assertEqual(Article.objects.count(), 0)
+        self.assertEqual(Article.vote_summary_model.objects.count(), 0)
+
+
+class ImportVotesTest(VotesTestCase):
+    def import_votes(self, model, lines, **options):
+        fd, path = tempfile.mkstemp(suffix='.csv')
+        try:
+            with os.fdopen(fd, 'w') as f:
+                f.write('\n'.join(lines) + '\n')
+            call_command('import_votes', model.get_model_name(), path, stdout=StringIO(), **options)
+        finally:
+            os.remove(path)
+
+    def test_dates_are_kept(self):
+        article = self.articles[0]
+        self.import_votes(Article.vote_model, [
+            'object_id,voter_id,value,date',
+            '%d,%d,1,2010-01-02 10:00' % (article.pk, self.users[0].pk),
+            '%d,%d,-1,' % (article.pk, self.users[1].pk),
+        ])
+        dates = dict(Article.vote_model.objects.values_list('voter', 'date'))
+        self.assertEqual((dates[self.users[0].pk].year, dates[self.users[0].pk].hour), (2010, 10))
+        self.assertNotEqual(dates[self.users[1].pk].year, 2010)
+        self.assertSummariesMatchVotes(Article.vote_summary_model, [article.pk])
+
+    def test_auto_now_add_is_left_alone(self):
+        # Other threads saving votes during the import still need it.
+        manager = Article.vote_model._base_manager
+        date_field = Article.vote_model._meta.get_field('date')
+        seen = []
+        def _insert(*args, **kwargs):
+            seen.append(date_field.auto_now_add)
+            return type(manager)._insert(manager, *args, **kwargs)
+        manager._insert = _insert
+        try:
+            self.import_votes(Article.vote_model, [
+                'object_id,voter_id,value,date',
+                '%d,%d,1,2010-01-02 10:00' % (self.articles[0].pk, self.users[0].pk),
+            ])
+        finally:
+            del manager._insert
+        self.assertEqual(seen, [True])
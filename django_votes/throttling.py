@@ -0,0 +1,115 @@
+"""
+Throttling of the voting views, enabled with the VOTES_THROTTLE_CACHE
+setting.
+
+Every user and every IP address gets a token bucket per vote model, kept
+in the cache: a request takes a token, and tokens come back at a steady
+rate. Requests without a token left are answered with a 429 before
+touching the database. The rates are set per vote model:
+
+    VOTES_THROTTLE_RATES = {
+        'default': {'user': (30, 60), 'ip': (120, 60)},  # 30 votes per minute per user
+        'app.MyModelVote': {'user': (10, 60), 'ip': (60, 60)},
+    }
+
+A user repeating their last vote on an object through these views within
+VOTES_THROTTLE_REPEAT_TIMEOUT seconds is answered as if the vote succeeded,
+without it being written again.
+
+The buckets are read and written without locking, so concurrent requests
+can occasionally get through a nearly empty bucket. That is acceptable for
+throttling.
+"""
+import time
+
+from django.core.cache import get_cache
+from django.http import HttpResponse
+
+from django_votes import settings as votes_settings
+from django_votes.instrumentation import count
+
+DEFAULT_RATES = {'user': (30, 60), 'ip': (120, 60)}
+
+
+def enabled():
+    return votes_settings.THROTTLE_CACHE is not None
+
+def _cache():
+    return get_cache(votes_settings.THROTTLE_CACHE)
+
+def _rates(model_name):
+    rates = votes_settings.THROTTLE_RATES
+    return rates.get(model_name) or rates.get('default') or DEFAULT_RATES
+
+def _take_token(cache, key, capacity, period):
+    """
+    Take a token from the bucket under key, which holds capacity tokens
+    and refills completely in period seconds. Returns 0 when a token was
+    taken, else the number of seconds until the next token.
+    """
+    now = time.time()
+    tokens, last = cache.get(key) or (capacity, now)
+    tokens = min(capacity, tokens + (now - last) * capacity / float(period))
+    if tokens < 1:
+        return (1 - tokens) * period / float(capacity)
+    cache.set(key, (tokens - 1, now), period)
+    return 0
+
+def _last_vote_key(request, model_name, object_id):
+    return 'django_votes:last:%s:%s:%s' % (model_name, object_id, request.user.pk)
+
+def _vote(request, action):
+    return '%s:%s' % (action, request.POST.get('rating', ''))
+
+def is_repeated(request, model_name, object_id, action):
+    """
+    Whether the user did this same vote on the object a moment ago.
+    """
+    if enabled() and request.user.is_authenticated() and \
+            _cache().get(_last_vote_key(request, model_name, object_id)) == _vote(request, action):
+        count('repeated_votes')
+        return True
+    return False
+
+def check(request, model_name):
+    """
+    Returns a response rejecting the request when it's throttled, else None.
+    """
+    if not enabled():
+        return None
+    cache = _cache()
+
+    rates = _rates(model_name)
+    buckets = [('ip', request.META.get('REMOTE_ADDR', ''))]
+    if request.user.is_authenticated():
+        buckets.append(('user', request.user.pk))
+
+    for bucket, ident in buckets:
+        if bucket not in rates:
+            continue
+        capacity, period = rates[bucket]
+        wait = _take_token(cache, 'django_votes:throttle:%s:%s:%s' % (model_name, bucket, ident),
+                           capacity, period)
+        if wait:
+            count('throttled_votes')
+            response = HttpResponse('Too many votes, try again later.', status=429)
+            response['Retry-After'] = str(int(wait) + 1)
+            return response
+    return None
+
+def voted(request, model_name, object_id, action):
+    """
+    Remember the vote of the user on an object, so that repeating it is
+    skipped.
+    """
+    if enabled() and request.user.is_authenticated() and votes_settings.THROTTLE_REPEAT_TIMEOUT:
+        _cache().set(_last_vote_key(request, model_name, object_id), _vote(request, action),
+                     votes_settings.THROTTLE_REPEAT_TIMEOUT)
+
+def forget(request, model_name, object_id):
+    """
+    Forget the last vote of the user on an object, after the object was
+    voted on another way (e.g. in a batch).
+    """
+    if enabled() and request.user.is_authenticated():
+        _cache().delete(_last_vote_key(request, model_name, object_id))
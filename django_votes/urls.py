@@ -8,4 +8,8 @@ urlpatterns = patterns('',
     url(r'^updownvote-result/(?P<model_name>[^/]+)/(?P<object_id>\d+)/$', views.updownvote_result, name='votes_updownvote_result'),
     url(r'^rating/$', views.rating, name='votes_rating'),
     url(r'^rating-result/(?P<model_name>[^/]+)/(?P<object_id>\d+)/$', views.rating_result, name='votes_rating_result'),
+    url(r'^retract/$', views.retract, name='votes_retract'),
+    url(r'^batch/$', views.batch_vote, name='votes_batch'),
+    url(r'^summaries/(?P<model_name>[^/]+)/$', views.summaries, name='votes_summaries'),
+    url(r'^export/(?P<model_name>[^/]+)/$', views.export_view, name='votes_export'),
 )
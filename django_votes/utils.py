@@ -1,13 +1,71 @@
-from django_votes.models import _vote_models, _rating_models
+from datetime import datetime, time
+
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import AutoField
+from django.utils import timezone
+from django.utils.dateparse import parse_date, parse_datetime
+
+from django_votes.registry import registry
 
 def get_vote_model(model_name):
-    if model_name in _vote_models:
-        return _vote_models[model_name]
-    else:
-        raise Exception('No such vote model "%s"' % model_name)
+    """
+    The vote model with the given name or numeric id.
+    """
+    return registry.vote_model(model_name)
 
 def get_rating_model(model_name):
-    if model_name in _rating_models:
-        return _rating_models[model_name]
-    else:
-        raise Exception('No such rating model "%s"' % model_name)
+    """
+    The rating model with the given name or numeric id.
+    """
+    return registry.rating_model(model_name)
+
+def get_vote_or_rating_model(model_name):
+    """
+    The vote or rating model with the given name or numeric id.
+    """
+    return registry.vote_or_rating_model(model_name)
+
+def parse_since(value):
+    """
+    Parse a date ("2012-05-01") or date and time ("2012-05-01 12:00"), as
+    given to select the rows changed since then. Raises ValueError when
+    it's invalid.
+    """
+    parsed = parse_datetime(value)
+    if parsed is None and parse_date(value) is not None:
+        parsed = datetime.combine(parse_date(value), time())
+    if parsed is None:
+        raise ValueError('Invalid date "%s"' % value)
+    if settings.USE_TZ and timezone.is_naive(parsed):
+        parsed = timezone.make_aware(parsed, timezone.get_default_timezone())
+    return parsed
+
+def bulk_insert(model, objs, batch_size=None, raw=False):
+    """
+    Insert objs with bulk_create, at most batch_size rows per INSERT. SQLite
+    inserts the rows with one compound SELECT, which takes at most 500 terms
+    and 999 parameters, so fewer rows go into each INSERT there: the
+    bulk_create of Django 1.4.0 doesn't split them by itself.
+
+    With raw, the values of the objects (which must have no primary key
+    yet) are inserted as they are, without the pre_save() of their fields
+    which e.g. sets auto_now_add dates.
+    """
+    objs = list(objs)
+    if not objs:
+        return
+    connection = connections[model._default_manager.db]
+    if connection.vendor == 'sqlite':
+        limit = min(500, 999 // len(model._meta.local_fields))
+        batch_size = min(batch_size or limit, limit)
+    if not batch_size:
+        batch_size = len(objs)
+    fields = [field for field in model._meta.local_fields if not isinstance(field, AutoField)]
+    for i in range(0, len(objs), batch_size):
+        if raw:
+            model._base_manager._insert(objs[i:i + batch_size], fields=fields,
+                                        using=connection.alias, raw=True)
+            transaction.commit_unless_managed(using=connection.alias)
+        else:
+            model._default_manager.bulk_create(objs[i:i + batch_size])
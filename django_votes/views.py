@@ -1,112 +1,348 @@
-from django.http import (HttpResponseForbidden, HttpResponse,
-                         HttpResponseRedirect,)
+import json
+import hashlib
+import time
+from calendar import timegm
+from collections import defaultdict
+
+from django.http import (HttpResponseForbidden, HttpResponse, HttpResponseBadRequest,
+                         HttpResponseRedirect, HttpResponseNotModified,)
+from django.utils import timezone
+from django.utils.http import (http_date, parse_http_date_safe,
+                               parse_etags, quote_etag,)
+
+try:
+    from django.http import StreamingHttpResponse
+except ImportError:
+    # Django < 1.5 streams the iterators given to HttpResponse.
+    StreamingHttpResponse = HttpResponse
 
 from django.contrib.contenttypes.models import ContentType
 from django.contrib.auth.models import User
-from django.db.models import Avg
 
 from django.core.urlresolvers import reverse
-from django.shortcuts import render_to_response
+from django.shortcuts import render_to_response, get_object_or_404
 from django.template.context import RequestContext
 
-from django_votes.utils import get_vote_model
+from django_votes import export, throttling
+from django_votes import settings as votes_settings
+from django_votes.backends import DatabaseBackend
+from django_votes.instrumentation import instrumented
+from django_votes.registry import registry, UnknownModel, RATING
+from django_votes.utils import (get_vote_model, get_rating_model, get_vote_or_rating_model,
+                                parse_since)
 
-def _api_view(func):
+def _json_response(data, status=200):
+    return HttpResponse(json.dumps(data), status=status,
+                        content_type='application/json')
+
+def _summary_values(summary):
     """
-    Extracts model information from the POST dictionary and gets the vote model from them.
+    The counts of a vote or rating summary, as a dict.
     """
+    return dict((field.attname, getattr(summary, field.attname))
+                for field in summary._meta.fields
+                if field.attname not in ('id', 'object_id', 'created_on', 'updated_on'))
 
-    def view(request):
-        if request.method == 'POST':
-            # Get comments model
-            model_name = request.POST['model']
-            model = get_vote_model(model_name)
-
-            object_id = request.POST['object_id']
-            # View
-            result = func(request, model, object_id)
+def _invalid_value(model, value):
+    """
+    Why a vote or rating can't have the given value, or None when it can:
+    votes are 1 or -1, ratings 1 to VOTES_RATING_MAX.
+    """
+    if registry.kind(model) == RATING:
+        valid = 1 <= value <= votes_settings.RATING_MAX
+    else:
+        valid = value in (1, -1)
+    if not valid:
+        return 'Invalid value %d for %s' % (value, model.get_model_name())
+    return None
+
+def _result_redirect(model, object_id):
+    """
+    Redirect to the view showing the votes or the ratings of an object.
+    """
+    result_view = 'votes_rating_result' if registry.kind(model) == RATING else 'votes_updownvote_result'
+    return HttpResponseRedirect(reverse(result_view, args=[model.get_model_name(), object_id]))
 
-            if result:
-                return result
-            else:
-                # ... and redirect to next.
-                if 'next' in request.REQUEST:
-                    return HttpResponseRedirect(request.REQUEST['next'])
+def _api_view(get_model):
+    """
+    Extracts model information from the POST dictionary and gets the vote
+    model from them with get_model. The model is given by name or by numeric
+    id.
+    """
+    def decorator(func):
+        def view(request):
+            if request.method == 'POST':
+                try:
+                    model_name = request.POST['model']
+                    object_id = int(request.POST['object_id'])
+                except (KeyError, ValueError):
+                    return HttpResponseBadRequest('model and object_id are required')
+
+                # The model is looked up in memory after its first use.
+                try:
+                    model = get_model(model_name)
+                except UnknownModel as e:
+                    return HttpResponseBadRequest(unicode(e))
+
+                # Reject abusive and repeated requests before any query. The
+                # limits are per model, whether it's given by name or by id.
+                model_name = model.get_model_name()
+                rejected = throttling.check(request, model_name)
+                if rejected:
+                    return rejected
+
+                # View. A repeated vote isn't written again, but answered
+                # like the first one.
+                if throttling.is_repeated(request, model_name, object_id, func.__name__):
+                    result = _result_redirect(model, object_id)
                 else:
-                    return HttpResponse('OK')
-        else:
-            # Default response: 403
-            return HttpResponseForbidden()
-    return view
+                    result = func(request, model, object_id)
+                    throttling.voted(request, model_name, object_id, func.__name__)
 
-@_api_view
+                if result:
+                    return result
+                else:
+                    # ... and redirect to next.
+                    if 'next' in request.REQUEST:
+                        return HttpResponseRedirect(request.REQUEST['next'])
+                    else:
+                        return HttpResponse('OK')
+            else:
+                # Default response: 403
+                return HttpResponseForbidden()
+        view.__name__ = func.__name__
+        view.__doc__ = func.__doc__
+        return view
+    return decorator
+
+@instrumented('view.down_vote')
+@_api_view(get_vote_model)
 def down_vote(request, model, object_id):
     """
     Dislikes an item
     """
 
-    if model.objects.filter(object__id=object_id, voter=request.user).count() == 0:
-        model.objects.create(object_id=object_id,
-                             voter=request.user,
-                             value= -1)
+    model.objects.cast(request.user, object_id, -1)
 
-    return HttpResponseRedirect(reverse('votes_updownvote_result', args=[model.get_model_name(),
-                                                                         object_id]))
+    return _result_redirect(model, object_id)
 
-@_api_view
+@instrumented('view.up_vote')
+@_api_view(get_vote_model)
 def up_vote(request, model, object_id):
     """
     Likes an item
     """
 
-    if model.objects.filter(object__id=object_id, voter=request.user).count() == 0:
-        model.objects.create(object_id=object_id,
-                             voter=request.user,
-                             value=1)
+    model.objects.cast(request.user, object_id, 1)
 
-    return HttpResponseRedirect(reverse('votes_updownvote_result', args=[model.get_model_name(),
-                                                                         object_id]))
+    return _result_redirect(model, object_id)
 
-@_api_view
+@instrumented('view.rating')
+@_api_view(get_rating_model)
 def rating(request, model, object_id):
     """
     Gives a rating to an item
     """
 
-    rating = request.POST['rating']
+    try:
+        rating = int(request.POST['rating'])
+    except (KeyError, ValueError):
+        return HttpResponseBadRequest('rating is required')
+    error = _invalid_value(model, rating)
+    if error:
+        return HttpResponseBadRequest(error)
+
+    model.objects.cast(request.user, object_id, rating)
 
-    if model.objects.filter(object__id=object_id, voter=request.user).count() == 0:
-        model.objects.create(object_id=object_id,
-                             voter=request.user,
-                             value=rating)
+    return _result_redirect(model, object_id)
+
+@instrumented('view.retract')
+@_api_view(get_vote_or_rating_model)
+def retract(request, model, object_id):
+    """
+    Removes your vote or rating on an item
+    """
 
-    return HttpResponseRedirect(reverse('votes_rating_result', args=[model.get_model_name(),
-                                                                     object_id]))
+    model.objects.retract(request.user, object_id)
 
+    return _result_redirect(model, object_id)
+
+@instrumented('view.batch_vote')
+def batch_vote(request):
+    """
+    Applies many votes and ratings at once. The request body is a JSON list
+    of {"model": ..., "object_id": ..., "value": ...} actions, the response
+    lists the resulting summary of every object that was voted on.
+    """
+    if request.method != 'POST' or not request.user.is_authenticated():
+        return HttpResponseForbidden()
+
+    try:
+        actions = [(get_vote_or_rating_model(action['model']),
+                    int(action['object_id']),
+                    int(action['value']))
+                   for action in json.loads(request.body)]
+    except Exception as e:
+        return _json_response({'error': unicode(e)}, status=400)
+
+    # A batch with an invalid action is rejected as a whole, before any vote
+    # is written.
+    object_ids = defaultdict(set)
+    for model, object_id, value in actions:
+        error = _invalid_value(model, value)
+        if error:
+            return _json_response({'error': error}, status=400)
+        object_ids[model].add(object_id)
+
+    # Every action takes a token, the same way.
+    for model, object_id, value in actions:
+        rejected = throttling.check(request, model.get_model_name())
+        if rejected:
+            return rejected
+
+    # The objects are looked up with one query per model.
+    for model, ids in object_ids.items():
+        found = model.get_owner_model()._default_manager.filter(pk__in=ids).values_list('pk', flat=True)
+        missing = ids.difference(found)
+        if missing:
+            return _json_response({'error': 'No such object %d for %s' % (min(missing), model.get_model_name())},
+                                  status=400)
+
+    for model, object_id, value in actions:
+        model.objects.cast(request.user, object_id, value)
+        # So that the next vote on the object through the other views isn't
+        # skipped as a repeat of an older one.
+        throttling.forget(request, model.get_model_name(), object_id)
+
+    results = []
+    for model, ids in object_ids.items():
+        summaries = model.get_summary_model().objects.get_many(ids)
+        for object_id in sorted(ids):
+            result = _summary_values(summaries[object_id])
+            result.update({'model': model.get_model_name(), 'object_id': object_id})
+            results.append(result)
+
+    return _json_response(results)
+
+def _last_modified(summary_model, summaries):
+    """
+    The time the counts of summaries last changed, as a timestamp, or None
+    when their rows don't tell: shards, the deltas logged in deferred mode
+    and the counters of a cache change the counts without touching the
+    updated_on column.
+    """
+    if summary_model.shard_model is not None or votes_settings.DEFERRED_SUMMARIES or \
+            not isinstance(summary_model.summary_backend, DatabaseBackend):
+        return None
+    updated = [summary.updated_on for summary in summaries if summary.updated_on]
+    if not updated:
+        return None
+    last = max(updated)
+    if timezone.is_naive(last):
+        # Local time, when USE_TZ is False.
+        return int(time.mktime(last.timetuple()))
+    return timegm(last.utctimetuple())
+
+@instrumented('view.summaries')
+def summaries(request, model_name):
+    """
+    Returns the summaries of many objects as JSON, for up to
+    VOTES_SUMMARIES_MAX_IDS object ids given as ?ids=1,2,3. Supports
+    conditional requests through ETag and Last-Modified, based on the
+    updated_on column of the summaries.
+    """
+    try:
+        summary_model = get_vote_or_rating_model(model_name).get_summary_model()
+        object_ids = set(int(object_id) for object_id in request.GET.get('ids', '').split(',') if object_id)
+    except Exception as e:
+        return _json_response({'error': unicode(e)}, status=400)
+    if len(object_ids) > votes_settings.SUMMARIES_MAX_IDS:
+        return _json_response({'error': 'At most %d ids per request' % votes_settings.SUMMARIES_MAX_IDS},
+                              status=400)
+
+    found = summary_model.objects.get_many(object_ids, create=False)
+
+    # Don't write summaries in a GET, compute the missing ones on the fly.
+    missing = object_ids.difference(found)
+    found.update((object_id, summary_model(object_id=object_id, **values))
+                 for object_id, values in summary_model.aggregate(missing))
+
+    results = []
+    for object_id in sorted(object_ids):
+        summary = found.get(object_id)
+        if summary is None:
+            summary = summary_model(object_id=object_id)
+            summary.update_derived()
+        result = _summary_values(summary)
+        result['object_id'] = object_id
+        results.append(result)
+
+    content = json.dumps(results)
+    etag = hashlib.md5(content).hexdigest()
+    last_modified = _last_modified(summary_model, found.values())
+
+    if_none_match = request.META.get('HTTP_IF_NONE_MATCH')
+    if_modified_since = parse_http_date_safe(request.META.get('HTTP_IF_MODIFIED_SINCE'))
+    if if_none_match:
+        etags = parse_etags(if_none_match)
+        not_modified = etag in etags or '*' in etags
+    else:
+        not_modified = bool(last_modified and if_modified_since and last_modified <= if_modified_since)
+
+    response = HttpResponseNotModified() if not_modified else \
+               HttpResponse(content, content_type='application/json')
+    response['ETag'] = quote_etag(etag)
+    if last_modified:
+        response['Last-Modified'] = http_date(last_modified)
+    return response
+
+def export_view(request, model_name):
+    """
+    Streams a vote, rating or summary model as CSV, or as JSON Lines with
+    ?format=jsonl. ?since=2012-05-01 only exports the votes cast, or the
+    summaries updated, since then. Staff only.
+    """
+    if not request.user.is_staff:
+        return HttpResponseForbidden()
+
+    format = request.GET.get('format', 'csv')
+    try:
+        model = registry.get(model_name)
+        since = parse_since(request.GET['since']) if request.GET.get('since') else None
+        if format not in export.FORMATS:
+            raise ValueError('Unknown format "%s"' % format)
+    except (UnknownModel, ValueError) as e:
+        return HttpResponseBadRequest(unicode(e))
+
+    response = StreamingHttpResponse(export.lines(model, format, since),
+                                     content_type='text/csv' if format == 'csv' else 'application/x-ndjson')
+    response['Content-Disposition'] = 'attachment; filename=%s.%s' % (model_name, format)
+    return response
+
+@instrumented('view.updownvote_result')
 def updownvote_result(request, model_name, object_id):
     """
     Display the likes and dislikes of an item
     """
 
-    model = get_vote_model(model_name)
-
-    # Get your own vote
-    your_vote = model.objects.filter(voter=request.user)
+    try:
+        model = get_vote_model(model_name)
+    except UnknownModel as e:
+        return HttpResponseBadRequest(unicode(e))
 
-    if your_vote:
-        your_vote = your_vote[0]
+    object = get_object_or_404(model.get_owner_model(), pk=object_id)
 
-    # Extract the object what these votes are about. (There's gotta be a better way to do this)
-    object = model.objects.select_related('object').filter(object__id=object_id)[:1][0].object
+    # Get your own vote
+    your_vote = None
+    if request.user.is_authenticated():
+        for your_vote in model.objects.filter(object=object, voter=request.user).order_by()[:1]:
+            pass
 
-    # Get the likes
-    up_votes = model.objects.filter(object__id=object_id,
-                                    value__gt=0).count()
-    # Get the dislikes
-    down_votes = model.objects.filter(object__id=object_id,
-                                      value__lt=0).count()
-    # Get the total votes
-    total_votes = model.objects.filter(object__id=object_id).count()
+    # The counts are kept in the vote summary
+    summary = object.vote_summary
+    up_votes = summary.up_votes
+    down_votes = summary.down_votes
+    total_votes = summary.total_votes
 
     # Calculate the percentages in order to fill the bars
     up_pct = (float(up_votes) / float(total_votes) if total_votes else 0) * 98
@@ -125,28 +361,31 @@ def updownvote_result(request, model_name, object_id):
                               context,
                               context_instance=RequestContext(request))
 
+@instrumented('view.rating_result')
 def rating_result(request, model_name, object_id):
     """
     Display the average rating of an item
     """
 
-    model = get_vote_model(model_name)
-
-    # Get your own vote
-    your_vote = model.objects.filter(voter=request.user)
+    try:
+        model = get_rating_model(model_name)
+    except UnknownModel as e:
+        return HttpResponseBadRequest(unicode(e))
 
-    if your_vote:
-        your_vote = your_vote[0]
+    object = get_object_or_404(model.get_owner_model(), pk=object_id)
 
-    # Extract the object what these votes are about. (There's gotta be a better way to do this)
-    object = model.objects.select_related('object').filter(object__id=object_id)[:1][0].object
+    # Get your own rating
+    your_vote = None
+    if request.user.is_authenticated():
+        for your_vote in model.objects.filter(object=object, rater=request.user).order_by()[:1]:
+            pass
 
-    # Get the average rating
-    rating = model.objects.filter(object__id=object_id).aggregate(value=Avg('value'))
+    # The average rating is kept in the rating summary
+    rating = object.rating_summary.rating
 
     context = {'model_name': model_name,
                'object': object,
-               'rating': rating['value'],
+               'rating': rating,
                'your_vote': your_vote}
 
     return render_to_response('django_votes/rating.html',
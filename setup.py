@@ -9,7 +9,7 @@ setup(
     description="Voting system for various things",
     long_description=open('README', 'r').read(),
     author='Maarten Timmerman, City Live nv',
-    packages=find_packages('.'),
+    packages=find_packages('.', exclude=['benchmarks', 'benchmarks.*']),
       # package_data={'django_votes': [
       #             'static/*/*/*.js',
       #             'static/*/*/*.css',